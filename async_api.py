@@ -0,0 +1,209 @@
+import asyncio
+import os
+import threading
+
+import numpy as np
+
+from lexical_index import RETRIEVAL_MODE
+from parallel import default_workers, extract_structures, new_pool, replace_broken
+from structure_cache import default_cache
+from task_1b import encode_texts, load_model, rank_documents
+
+# Most texts coalesced into one model call
+ASYNC_BATCH_TEXTS = int(os.environ.get("ASYNC_BATCH_TEXTS", "128"))
+# How long the first request of a micro-batch waits for others to join it
+ASYNC_BATCH_DELAY_MS = float(os.environ.get("ASYNC_BATCH_DELAY_MS", "5"))
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent encode(texts) calls from many coroutines into shared model
+    calls. A batch is sent once it holds max_batch texts or max_delay seconds after
+    its first request, and only one model call runs at a time, in a worker thread,
+    so the event loop never blocks. A cancelled caller's texts are dropped if its
+    batch has not started yet.
+    """
+
+    def __init__(self, encode_fn, max_batch=ASYNC_BATCH_TEXTS, max_delay=ASYNC_BATCH_DELAY_MS / 1000):
+        self.encode_fn = encode_fn
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self.calls = 0
+        self.requests = 0
+        self._pending = []
+        self._wakeup = None
+        self._task = None
+
+    async def encode(self, texts):
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((texts, future))
+        self.requests += 1
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        if sum(len(t) for t, _ in self._pending) >= self.max_batch:
+            self._wakeup.set()
+        return await future
+
+    async def _run(self):
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            # Whole requests, oldest first; a request larger than max_batch goes alone
+            batch, size = [], 0
+            while self._pending and (not batch or size + len(self._pending[0][0]) <= self.max_batch):
+                texts, future = self._pending.pop(0)
+                if not future.done():
+                    batch.append((texts, future))
+                    size += len(texts)
+            if not batch:
+                continue
+
+            try:
+                vectors = await asyncio.to_thread(self.encode_fn, [text for texts, _ in batch for text in texts])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.calls += 1
+            offset = 0
+            for texts, future in batch:
+                if not future.done():
+                    future.set_result(vectors[offset:offset + len(texts)])
+                offset += len(texts)
+
+
+class AsyncAnalyzer:
+    """
+    asyncio API over the ranking pipeline for use inside an event loop:
+        async with AsyncAnalyzer() as analyzer:
+            result = await analyzer.find_relevant_sections(pdf_paths, persona, job, timeout=30)
+            async for partial in analyzer.iter_relevant_sections(pdf_paths, persona, job):
+                ...
+    PDF parsing runs in a shared process pool and encoding goes through a
+    MicroBatcher, so concurrent calls share model batches. Ranking itself runs in
+    worker threads whose encode calls are bridged back to the batcher. Cancelling a
+    call (or hitting its timeout) stops its ranking at its next encode. A PDF
+    already being parsed in the pool runs to completion.
+    """
+
+    def __init__(self, workers=None, max_batch=ASYNC_BATCH_TEXTS, max_delay=ASYNC_BATCH_DELAY_MS / 1000):
+        self.workers = workers or default_workers()
+        self.model = None
+        self.cache = default_cache()
+        self.batcher = MicroBatcher(self._encode_sync, max_batch, max_delay)
+        self._pool = None
+        self._loop = None
+        self._started = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self):
+        # Concurrent first calls share one startup
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._start())
+        await asyncio.shield(self._started)
+
+    async def _start(self):
+        self._loop = asyncio.get_running_loop()
+        # Spawned workers, created before the model: never fork a process running the loop's threads or torch
+        self._pool = new_pool(self.workers, "spawn")
+        self.model = await asyncio.to_thread(load_model)
+
+    async def close(self):
+        if self._pool is not None:
+            await asyncio.to_thread(self._pool.shutdown)
+            self._pool = None
+            self._started = None
+
+    def _encode_sync(self, texts):
+        return encode_texts(self.model, texts)
+
+    async def encode(self, texts):
+        """
+        Encodes texts into normalized vectors, sharing model calls with concurrent callers.
+        """
+        await self.start()
+        return await self.batcher.encode(texts)
+
+    async def extract(self, pdf_path):
+        """
+        Extracts one PDF's structure in the process pool (or from the structure cache).
+        """
+        await self.start()
+        # A worker crash breaks the whole pool: replace it for later calls
+        self._pool = replace_broken(self._pool, self.workers)
+        structures = await asyncio.to_thread(extract_structures, [pdf_path], cache=self.cache, executor=self._pool)
+        return structures[0]
+
+    async def _rank(self, pdf_paths, structures, persona, job_to_be_done, mode):
+        """
+        Runs rank_documents on already extracted structures in a worker thread. Its encode
+        calls go back to the event loop's batcher; once this coroutine is cancelled,
+        the thread stops at its next encode.
+        """
+        cancelled = threading.Event()
+
+        def encode(texts):
+            if cancelled.is_set():
+                raise asyncio.CancelledError()
+            return asyncio.run_coroutine_threadsafe(self.batcher.encode(texts), self._loop).result()
+
+        try:
+            return await asyncio.to_thread(
+                rank_documents, pdf_paths, persona, job_to_be_done, self.model, encode, lambda _: structures, mode
+            )
+        finally:
+            cancelled.set()
+
+    async def find_relevant_sections(self, pdf_paths, persona, job_to_be_done, mode=RETRIEVAL_MODE, timeout=None):
+        """
+        Async find_relevant_sections with the same output. The PDFs are parsed
+        concurrently. Raises asyncio.TimeoutError after timeout seconds.
+        """
+        async def run():
+            await self.start()
+            structures = await asyncio.gather(*(self.extract(path) for path in pdf_paths))
+            return await self._rank(list(pdf_paths), list(structures), persona, job_to_be_done, mode)
+
+        return await asyncio.wait_for(run(), timeout)
+
+    async def iter_relevant_sections(self, pdf_paths, persona, job_to_be_done, mode=RETRIEVAL_MODE, timeout=None):
+        """
+        Streams per-document results in completion order: for each PDF, as soon as it is
+        parsed and ranked, yields its find_relevant_sections output computed over that
+        document alone (or an {"error": ...} entry with its "document"). Raises
+        asyncio.TimeoutError if everything is not done within timeout seconds; leaving
+        the loop early cancels the documents still in progress.
+        """
+        await self.start()
+
+        async def document(path):
+            structure = await self.extract(path)
+            if "error" in structure:
+                return {"document": os.path.basename(path), "error": structure["error"]}
+            result = await self._rank([path], [structure], persona, job_to_be_done, mode)
+            result.setdefault("document", os.path.basename(path))
+            return result
+
+        tasks = [asyncio.ensure_future(document(path)) for path in pdf_paths]
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=timeout):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
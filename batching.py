@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from instrumentation import count
+
+# Most tokens (padding included) per forward batch
+TOKEN_BUDGET = int(os.environ.get("ENCODE_TOKEN_BUDGET", "8192"))
+# Tokens shared by consecutive windows of a section longer than the model's max sequence length
+WINDOW_OVERLAP = int(os.environ.get("ENCODE_WINDOW_OVERLAP", "32"))
+
+_stats = {"texts": 0, "windows": 0, "batches": 0, "tokens": 0, "padded_tokens": 0, "seconds": 0.0}
+_stats_lock = threading.Lock()
+
+
+def split_windows(ids, body_length, overlap):
+    """
+    Splits a token id sequence into windows of at most body_length tokens, each
+    starting body_length - overlap tokens after the previous one. Short sequences
+    (and empty ones) give a single window.
+    """
+    if len(ids) <= body_length:
+        return [ids]
+    step = max(body_length - overlap, 1)
+    windows = []
+    for start in range(0, len(ids), step):
+        windows.append(ids[start:start + body_length])
+        if start + body_length >= len(ids):
+            break
+    return windows
+
+
+def plan_batches(lengths, token_budget):
+    """
+    Groups sequence indices into batches, longest first, so that each batch's padded
+    size (count x its longest sequence) stays within token_budget. A sequence longer
+    than the budget gets a batch of its own.
+    """
+    order = np.argsort([-length for length in lengths], kind="stable").tolist()
+    batches = []
+    batch = []
+    for i in order:
+        # Sorted longest first, so the batch's first sequence sets its width
+        if batch and (len(batch) + 1) * lengths[batch[0]] > token_budget:
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _report(stats):
+    report = dict(stats)
+    report["seconds"] = round(stats["seconds"], 4)
+    report["tokens_per_second"] = round(stats["tokens"] / stats["seconds"], 1) if stats["seconds"] else 0.0
+    report["padding_ratio"] = round(1 - stats["tokens"] / stats["padded_tokens"], 4) if stats["padded_tokens"] else 0.0
+    return report
+
+
+def encode_budgeted(encoder, texts, token_budget=TOKEN_BUDGET, overlap=WINDOW_OVERLAP):
+    """
+    Encodes texts with length-bucketed, token-budgeted batches. Each text is
+    tokenized once. Texts longer than the encoder's max_seq_length are split into
+    overlapping windows instead of being truncated, and their window embeddings are
+    averaged back (weighted by window length) into one normalized vector per text.
+    Returns (embeddings, stats), where stats includes tokens_per_second and
+    padding_ratio, the share of forward tokens spent on padding.
+    """
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32), _report({key: 0 for key in _stats})
+
+    start_time = time.perf_counter()
+    body_length = encoder.max_seq_length - 2  # room for [CLS] and [SEP]
+    windows = []
+    owners = []
+    for i, ids in enumerate(encoder.token_ids(texts)):
+        for window in split_windows(ids, body_length, overlap):
+            windows.append([encoder.cls_id] + list(window) + [encoder.sep_id])
+            owners.append(i)
+
+    lengths = [len(window) for window in windows]
+    vectors = None
+    padded_tokens = 0
+    batches = plan_batches(lengths, token_budget)
+    for batch in batches:
+        width = lengths[batch[0]]
+        input_ids = np.zeros((len(batch), width), dtype=np.int64)
+        attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+        for row, w in enumerate(batch):
+            input_ids[row, :lengths[w]] = windows[w]
+            attention_mask[row, :lengths[w]] = 1
+        embedded = encoder.embed_ids(input_ids, attention_mask)
+        if vectors is None:
+            vectors = np.zeros((len(windows), embedded.shape[1]), dtype=np.float32)
+        vectors[batch] = embedded
+        padded_tokens += input_ids.size
+
+    # Pool the windows of each text, weighted by their token counts
+    weights = np.asarray(lengths, dtype=np.float32) - 2
+    pooled = np.zeros((len(texts), vectors.shape[1]), dtype=np.float32)
+    np.add.at(pooled, owners, vectors * np.maximum(weights, 1)[:, None])
+    pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    stats = {
+        "texts": len(texts), "windows": len(windows), "batches": len(batches),
+        "tokens": int(sum(lengths)), "padded_tokens": int(padded_tokens),
+        "seconds": time.perf_counter() - start_time
+    }
+    with _stats_lock:
+        for key, value in stats.items():
+            _stats[key] += value
+    count("texts_encoded", stats["texts"])
+    count("windows_encoded", stats["windows"])
+    count("tokens_encoded", stats["tokens"])
+    count("padded_tokens_encoded", stats["padded_tokens"])
+    return pooled, _report(stats)
+
+
+def encode_stats():
+    """
+    Cumulative encode statistics of this process, with tokens_per_second and padding_ratio.
+    """
+    with _stats_lock:
+        return _report(_stats)
+
+
+def encode_fixed(encoder, texts, batch_size=32):
+    """
+    The previous scheme, kept as a baseline: batches of batch_size texts in input
+    order, each truncated to max_seq_length. Returns (embeddings, stats).
+    """
+    start_time = time.perf_counter()
+    body_length = encoder.max_seq_length - 2
+    sequences = [[encoder.cls_id] + ids[:body_length] + [encoder.sep_id] for ids in encoder.token_ids(texts)]
+    vectors = []
+    padded_tokens = 0
+    for start in range(0, len(sequences), batch_size):
+        batch = sequences[start:start + batch_size]
+        width = max(len(s) for s in batch)
+        input_ids = np.zeros((len(batch), width), dtype=np.int64)
+        attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+        for row, s in enumerate(batch):
+            input_ids[row, :len(s)] = s
+            attention_mask[row, :len(s)] = 1
+        vectors.append(encoder.embed_ids(input_ids, attention_mask))
+        padded_tokens += input_ids.size
+    stats = {
+        "texts": len(texts), "windows": len(sequences), "batches": len(vectors),
+        "tokens": sum(len(s) for s in sequences), "padded_tokens": padded_tokens,
+        "seconds": time.perf_counter() - start_time
+    }
+    return np.concatenate(vectors).astype(np.float32), _report(stats)
+
+
+def compare_batching(pdf_paths, batch_size=32, token_budget=TOKEN_BUDGET, overlap=WINDOW_OVERLAP):
+    """
+    Encodes the chunks of pdf_paths with fixed-count batches and with the token-budgeted
+    scheduler, and reports throughput, padding and how many chunks would be truncated.
+    """
+    from parallel import extract_structures
+    from structure_cache import default_cache
+    from task_1b import build_chunks, load_model
+
+    contents = []
+    for pdf_path, structure in zip(pdf_paths, extract_structures(pdf_paths, cache=default_cache())):
+        if "error" in structure:
+            print(f"Skipping file due to error: {structure['error']}")
+            continue
+        contents.extend(chunk["content"] for chunk in build_chunks(structure, pdf_path))
+    if not contents:
+        raise ValueError("Could not extract any content from the documents.")
+
+    encoder = load_model()
+    encode_budgeted(encoder, contents[:4])  # warm-up
+    lengths = [len(ids) + 2 for ids in encoder.token_ids(contents)]
+    _, fixed = encode_fixed(encoder, contents, batch_size=batch_size)
+    _, budgeted = encode_budgeted(encoder, contents, token_budget=token_budget, overlap=overlap)
+    return {
+        "chunks": len(contents), "max_seq_length": encoder.max_seq_length,
+        "truncated_chunks": sum(length > encoder.max_seq_length for length in lengths),
+        "fixed": dict(fixed, batch_size=batch_size),
+        "budgeted": dict(budgeted, token_budget=token_budget, window_overlap=overlap)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare fixed-count and token-budgeted batching on a corpus.")
+    parser.add_argument("--pdfs", nargs="+", required=True)
+    parser.add_argument("--batch-size", type=int, default=32, help="Texts per batch of the fixed baseline.")
+    parser.add_argument("--token-budget", type=int, default=TOKEN_BUDGET)
+    parser.add_argument("--overlap", type=int, default=WINDOW_OVERLAP)
+    args = parser.parse_args()
+    print(json.dumps(compare_batching(args.pdfs, args.batch_size, args.token_budget, args.overlap), indent=2))
@@ -0,0 +1,268 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from lexical_index import retrieve
+from structure_extractor import (
+    HEADING_THRESHOLD, analyze_font_profile, build_structure, heading_features, parse_pages, score_heading,
+    score_headings
+)
+from task_1b import build_chunks, build_query, encode_texts, load_model, refine_sections
+from utils import create_synthetic_corpus
+
+STAGES = ("open", "parse_pages", "font_profile", "heading_detection", "chunking", "embedding", "ranking", "refinement")
+# A stage regresses when its p50 exceeds the baseline's by more than this fraction
+REGRESSION_TOLERANCE = 0.2
+# ... and by more than this many milliseconds, so timer noise on sub-millisecond stages is ignored
+MIN_REGRESSION_MS = 1.0
+
+DEFAULT_QUERY = ("An investment analyst with expertise in the tech sector.",
+                 "Analyze revenue growth, market risk and regulation compliance.")
+
+
+def _percentile(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 3) if values else 0.0
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def benchmark_document(pdf_path, encode, query_embedding, query_text, timings):
+    """
+    Runs the pipeline stage by stage on one PDF, appending each stage's seconds to
+    timings. Returns (pages, chunks), or None if the PDF cannot be opened.
+    """
+    import fitz  # PyMuPDF
+
+    start = time.perf_counter()
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception as e:
+        print(f"Skipping file due to error: {e}")
+        return None
+    timings["open"].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    shard = parse_pages(doc)
+    metadata = doc.metadata or {}
+    pages = doc.page_count
+    doc.close()
+    timings["parse_pages"].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    body_text_size = analyze_font_profile([shard])
+    timings["font_profile"].append(time.perf_counter() - start)
+
+    # The font profile is passed in so it is not timed again as part of heading detection
+    start = time.perf_counter()
+    structure = build_structure([shard], metadata, body_text_size=body_text_size)
+    timings["heading_detection"].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    chunks = build_chunks(structure, pdf_path)
+    timings["chunking"].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    embeddings = encode([chunk["content"] for chunk in chunks])
+    timings["embedding"].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    top_indices = retrieve([query_text], query_embedding, chunks, lambda texts: embeddings, mode="semantic")
+    timings["ranking"].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    refine_sections(query_embedding, chunks, top_indices, encode)
+    timings["refinement"].append(time.perf_counter() - start)
+    return pages, len(chunks)
+
+
+def run_benchmark(pdf_paths, query=DEFAULT_QUERY):
+    """
+    Benchmarks every stage over pdf_paths, one document at a time. Reports per-stage
+    p50/p95 latency (ms per document) and total seconds, pages/s and chunks/s over
+    the whole run, and the peak RSS of the process. The model is loaded and warmed
+    up before timing starts.
+    """
+    model = load_model()
+
+    def encode(texts):
+        return encode_texts(model, texts)
+
+    query_text = build_query(*query)
+    query_embedding = encode([query_text])
+
+    timings = {stage: [] for stage in STAGES}
+    pages = chunks = documents = 0
+    start = time.perf_counter()
+    for pdf_path in pdf_paths:
+        result = benchmark_document(pdf_path, encode, query_embedding, query_text, timings)
+        if result is None:
+            continue
+        pages += result[0]
+        chunks += result[1]
+        documents += 1
+    elapsed = time.perf_counter() - start
+
+    return {
+        "documents": documents, "pages": pages, "chunks": chunks,
+        "seconds": round(elapsed, 4),
+        "pages_per_second": round(pages / elapsed, 2) if elapsed else 0.0,
+        "chunks_per_second": round(chunks / elapsed, 2) if elapsed else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": {
+            stage: {
+                "p50_ms": _percentile(values, 50), "p95_ms": _percentile(values, 95),
+                "total_seconds": round(sum(values), 4)
+            }
+            for stage, values in timings.items()
+        }
+    }
+
+
+def compare_heading_scoring(pdf_paths, repeats=5):
+    """
+    Times heading scoring and ranking on the candidates of pdf_paths two ways: the
+    former per-block loop (score_heading on one dict per candidate, then sorted) and
+    the vectorized heading_features + score_headings + argsort. Checks that both
+    select the same headings in the same order, and reports candidates per second.
+    """
+    import fitz  # PyMuPDF
+
+    documents = []
+    for pdf_path in pdf_paths:
+        try:
+            doc = fitz.open(pdf_path)
+        except Exception as e:
+            print(f"Skipping file due to error: {e}")
+            continue
+        shard = parse_pages(doc)
+        doc.close()
+        candidates = shard["candidates"]
+        dicts = [
+            {"text": text, "size": int(candidates.size[i]), "is_bold": bool(candidates.bold[i]),
+             "page": int(candidates.page[i]), "bbox": tuple(candidates.bbox[i].tolist())}
+            for i, text in enumerate(candidates.texts())
+        ]
+        documents.append((candidates, dicts, analyze_font_profile([shard])))
+
+    def loop(candidates, dicts, body_text_size):
+        scored = []
+        for i, candidate in enumerate(dicts):
+            score = score_heading(candidate, body_text_size)
+            if score > HEADING_THRESHOLD:
+                scored.append((score, i))
+        return [i for _, i in sorted(scored, key=lambda x: x[0], reverse=True)]
+
+    def vectorized(candidates, dicts, body_text_size):
+        scores = score_headings(heading_features(candidates, body_text_size))
+        selected = np.flatnonzero(scores > HEADING_THRESHOLD)
+        return selected[np.argsort(-scores[selected], kind="stable")].tolist()
+
+    total = sum(len(candidates) for candidates, _, _ in documents)
+    report = {"documents": len(documents), "candidates": total}
+    for name, fn in (("loop", loop), ("vectorized", vectorized)):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for document in documents:
+                fn(*document)
+            times.append(time.perf_counter() - start)
+        best = min(times)
+        report[name] = {
+            "seconds": round(best, 6),
+            "candidates_per_second": round(total / best, 1) if best else 0.0
+        }
+    report["identical"] = all(loop(*document) == vectorized(*document) for document in documents)
+    report["speedup"] = round(report["loop"]["seconds"] / report["vectorized"]["seconds"], 2) if report["vectorized"]["seconds"] else 0.0
+    return report
+
+
+def compare_to_baseline(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compares a report with a stored one. Returns (comparison, regressions): the
+    per-stage p50 ratio against the baseline and the throughput ratios, plus the
+    names of the stages (or throughput metrics) that got worse by more than tolerance
+    (and, for stages, by more than MIN_REGRESSION_MS).
+    """
+    comparison = {"stages": {}}
+    regressions = []
+    for stage, stats in report["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {}).get("p50_ms")
+        if not before:
+            continue
+        ratio = stats["p50_ms"] / before
+        comparison["stages"][stage] = {"baseline_p50_ms": before, "p50_ms": stats["p50_ms"], "ratio": round(ratio, 3)}
+        if ratio > 1 + tolerance and stats["p50_ms"] - before > MIN_REGRESSION_MS:
+            regressions.append(stage)
+    for metric in ("pages_per_second", "chunks_per_second"):
+        if baseline.get(metric):
+            ratio = report[metric] / baseline[metric]
+            comparison[metric] = {"baseline": baseline[metric], "current": report[metric], "ratio": round(ratio, 3)}
+            if ratio < 1 - tolerance:
+                regressions.append(metric)
+    if baseline.get("peak_rss_mb"):
+        comparison["peak_rss_mb"] = {"baseline": baseline["peak_rss_mb"], "current": report["peak_rss_mb"]}
+    return comparison, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on a synthetic or given PDF corpus.")
+    parser.add_argument("--pdfs", nargs="+", help="Benchmark these PDFs instead of a synthetic corpus.")
+    parser.add_argument("--documents", type=int, default=5, help="Synthetic documents to generate.")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per synthetic document.")
+    parser.add_argument("--heading-depth", type=int, default=3)
+    parser.add_argument("--unnumbered", action="store_true", help="Generate headings without 1. / 1.2 numbering.")
+    parser.add_argument("--fonts", nargs="+", default=["helv"], help="Font families to cycle through (helv, times, courier).")
+    parser.add_argument("--columns", type=int, nargs="+", default=[1], help="Column layouts to cycle through (1 or 2).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus-dir", help="Keep the synthetic corpus here (default: a temporary directory).")
+    parser.add_argument("--baseline", help="Baseline report to compare with; the exit status is 1 on a regression.")
+    parser.add_argument("--save-baseline", help="Write this run's report here for later comparisons.")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("--headings", action="store_true",
+                        help="Only compare per-block and vectorized heading scoring throughput.")
+    args = parser.parse_args()
+    if args.baseline and not os.path.exists(args.baseline):
+        parser.error(f"baseline '{args.baseline}' does not exist")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_paths = args.pdfs or create_synthetic_corpus(
+            args.corpus_dir or tmp_dir, documents=args.documents, pages=args.pages,
+            heading_depth=args.heading_depth, numbered=not args.unnumbered,
+            fonts=tuple(args.fonts), columns=tuple(args.columns), seed=args.seed
+        )
+        if args.headings:
+            print(json.dumps(compare_heading_scoring(pdf_paths), indent=2))
+            return
+        report = run_benchmark(pdf_paths)
+
+    report["corpus"] = {"pdfs": args.pdfs} if args.pdfs else {
+        "documents": args.documents, "pages": args.pages, "heading_depth": args.heading_depth,
+        "numbered": not args.unnumbered, "fonts": args.fonts, "columns": args.columns, "seed": args.seed
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["comparison"], regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+
+    print(json.dumps(report, indent=2))
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+    if regressions:
+        print(f"Regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+import os
+import re
+
+import numpy as np
+
+# Numbered headings: "1 ", "2.3 ", "4.1.2 " or "A. "
+NUMBERING = re.compile(r'^((\d+\.)*\d+|[A-Z]\.)\s')
+# Section numbers for the outline depth, also with a trailing period: "1. ", "2.3 ", "4.1.2. ", "A. "
+SECTION_NUMBER = re.compile(r'^(?:(\d+(?:\.\d+)*)\.?|[A-Z]\.)\s')
+
+
+def numbering_depth(text):
+    """
+    The number of components of a heading's section number ("4.1.2 Scope" is 3, "A. Notes" is 1), or 0 if unnumbered.
+    """
+    match = SECTION_NUMBER.match(text)
+    if match is None:
+        return 0
+    return match.group(1).count(".") + 1 if match.group(1) else 1
+
+
+def pack_texts(texts):
+    """
+    Packs strings into one contiguous UTF-8 buffer (uint8) plus an int64 offsets
+    array of len(texts) + 1; text i is buffer[offsets[i]:offsets[i + 1]].
+    """
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8).copy(), offsets
+
+
+def _concat_texts(tables):
+    buffers, offsets, base = [], [np.zeros(1, dtype=np.int64)], 0
+    for table in tables:
+        buffers.append(table.text)
+        offsets.append(table.text_offsets[1:] + base)
+        base += len(table.text)
+    return np.concatenate(buffers or [np.zeros(0, dtype=np.uint8)]), np.concatenate(offsets)
+
+
+class _Columns:
+    """
+    Shared storage of the columnar tables: one NumPy array per column, including a
+    contiguous text buffer with offsets. Tables pickle as a handful of arrays and
+    save as npz or as a directory of .npy files that load memory-mapped.
+    """
+
+    COLUMNS = ()
+
+    def __init__(self, **arrays):
+        for name in self.COLUMNS:
+            setattr(self, name, arrays[name])
+
+    def text_at(self, i):
+        return bytes(self.text[self.text_offsets[i]:self.text_offsets[i + 1]]).decode("utf-8")
+
+    def texts(self, indices=None):
+        """
+        Decodes the texts at indices (default: all) in bulk.
+        """
+        if indices is None:
+            indices = np.arange(len(self.text_offsets) - 1)
+        indices = np.asarray(indices, dtype=np.int64)
+        buffer = memoryview(self.text)
+        starts = self.text_offsets[indices].tolist()
+        stops = self.text_offsets[indices + 1].tolist()
+        return [str(buffer[start:stop], "utf-8") for start, stop in zip(starts, stops)]
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.COLUMNS}
+
+    def save_npz(self, path):
+        np.savez(path, **self.arrays())
+
+    @classmethod
+    def load_npz(cls, path):
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in cls.COLUMNS})
+
+    def save(self, directory):
+        """
+        Writes one .npy file per column into directory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name, array in self.arrays().items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Loads a table written by save; with mmap, the columns are read-only memory maps
+        and nothing is copied until accessed.
+        """
+        mode = "r" if mmap else None
+        return cls(**{name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode) for name in cls.COLUMNS})
+
+
+class BlockTable(_Columns):
+    """
+    The text blocks of a document (PyMuPDF's get_text("blocks") per page) as columns:
+    bbox (float64, N x 4), block_no, block_type, has_text (non-blank text) and the
+    text buffer, grouped by page through page_offsets (pages + 1 entries).
+
+    It also behaves like the former raw_blocks list of per-page tuple lists:
+    len(table) is the page count and table[page_idx] rebuilds that page's tuples.
+    """
+
+    COLUMNS = ("page_offsets", "bbox", "block_no", "block_type", "has_text", "text_offsets", "text")
+
+    @classmethod
+    def from_pages(cls, pages):
+        """
+        Builds a table from per-page lists of (x0, y0, x1, y1, text, block_no, block_type) tuples.
+        """
+        counts = [len(blocks) for blocks in pages]
+        page_offsets = np.zeros(len(pages) + 1, dtype=np.int64)
+        np.cumsum(counts, out=page_offsets[1:])
+        blocks = [block for page in pages for block in page]
+        texts = [block[4] for block in blocks]
+        text, text_offsets = pack_texts(texts)
+        return cls(
+            page_offsets=page_offsets,
+            bbox=np.array([block[:4] for block in blocks], dtype=np.float64).reshape(-1, 4),
+            block_no=np.array([block[5] for block in blocks], dtype=np.int32),
+            block_type=np.array([block[6] for block in blocks], dtype=np.int8),
+            has_text=np.array([bool(t.strip()) for t in texts], dtype=bool),
+            text_offsets=text_offsets,
+            text=text
+        )
+
+    @classmethod
+    def empty(cls):
+        return cls.from_pages([])
+
+    @classmethod
+    def concat(cls, tables):
+        """
+        Joins tables of consecutive page ranges into one.
+        """
+        tables = list(tables)
+        if not tables:
+            return cls.empty()
+        if len(tables) == 1:
+            return tables[0]
+        page_offsets, base = [np.zeros(1, dtype=np.int64)], 0
+        for table in tables:
+            page_offsets.append(table.page_offsets[1:] + base)
+            base += table.block_count
+        text, text_offsets = _concat_texts(tables)
+        return cls(
+            page_offsets=np.concatenate(page_offsets),
+            bbox=np.concatenate([table.bbox for table in tables]),
+            block_no=np.concatenate([table.block_no for table in tables]),
+            block_type=np.concatenate([table.block_type for table in tables]),
+            has_text=np.concatenate([table.has_text for table in tables]),
+            text_offsets=text_offsets,
+            text=text
+        )
+
+    @property
+    def page_count(self):
+        return len(self.page_offsets) - 1
+
+    @property
+    def block_count(self):
+        return len(self.bbox)
+
+    def pages(self):
+        """
+        The page index (0-based) of every block.
+        """
+        return np.repeat(np.arange(self.page_count), np.diff(self.page_offsets))
+
+    def rows(self, indices):
+        """
+        Rebuilds the PyMuPDF block tuples (x0, y0, x1, y1, text, block_no, block_type) at indices.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        return [
+            (*bbox, text, block_no, block_type)
+            for bbox, text, block_no, block_type in zip(
+                self.bbox[indices].tolist(), self.texts(indices),
+                self.block_no[indices].tolist(), self.block_type[indices].tolist()
+            )
+        ]
+
+    def __len__(self):
+        return self.page_count
+
+    def __getitem__(self, page_idx):
+        if page_idx < 0:
+            page_idx += self.page_count
+        if not 0 <= page_idx < self.page_count:
+            raise IndexError("page index out of range")
+        return self.rows(np.arange(self.page_offsets[page_idx], self.page_offsets[page_idx + 1]))
+
+    def __iter__(self):
+        for page_idx in range(self.page_count):
+            yield self[page_idx]
+
+
+class HeadingCandidates(_Columns):
+    """
+    Single-line blocks that may be headings, as columns: page (1-based), bbox, font
+    size (rounded), bold, numbered (matches NUMBERING), numbering_depth, word_count,
+    ends_with_period and the text buffer. structure_extractor.heading_features turns
+    them into scoring features for all candidates at once.
+    """
+
+    COLUMNS = (
+        "page", "bbox", "size", "bold", "numbered", "numbering_depth", "word_count",
+        "ends_with_period", "text_offsets", "text"
+    )
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds the table from (text, size, is_bold, page, bbox) rows.
+        """
+        texts = [row[0] for row in rows]
+        text, text_offsets = pack_texts(texts)
+        return cls(
+            page=np.array([row[3] for row in rows], dtype=np.int32),
+            bbox=np.array([row[4] for row in rows], dtype=np.float64).reshape(-1, 4),
+            size=np.array([row[1] for row in rows], dtype=np.int32),
+            bold=np.array([row[2] for row in rows], dtype=bool),
+            numbered=np.array([NUMBERING.match(t) is not None for t in texts], dtype=bool),
+            numbering_depth=np.array([numbering_depth(t) for t in texts], dtype=np.int16),
+            word_count=np.array([len(t.split()) for t in texts], dtype=np.int32),
+            ends_with_period=np.array([t.endswith('.') for t in texts], dtype=bool),
+            text_offsets=text_offsets,
+            text=text
+        )
+
+    @classmethod
+    def concat(cls, tables):
+        tables = list(tables)
+        if not tables:
+            return cls.from_rows([])
+        if len(tables) == 1:
+            return tables[0]
+        text, text_offsets = _concat_texts(tables)
+        columns = {
+            name: np.concatenate([getattr(table, name) for table in tables])
+            for name in cls.COLUMNS if name not in ("text", "text_offsets")
+        }
+        return cls(text=text, text_offsets=text_offsets, **columns)
+
+    def __len__(self):
+        return len(self.page)
+
+    def heading(self, i, score):
+        """
+        The candidate as the heading dict passed to the heading classifiers.
+        """
+        return {
+            "score": score, "text": self.text_at(i), "size": int(self.size[i]),
+            "page": int(self.page[i]), "bbox": tuple(self.bbox[i].tolist()),
+            "numbering_depth": int(self.numbering_depth[i])
+        }
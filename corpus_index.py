@@ -0,0 +1,429 @@
+import argparse
+import itertools
+import json
+import os
+import shutil
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, default_store
+from encoder import embedding_model_id, resolve_backend
+from parallel import extract_structures
+from structure_cache import default_cache, file_hash
+from task_1b import (
+    STREAM_BATCH_SIZE, TOP_K, build_chunks, build_output, build_query, chunk_sentences, encode_texts,
+    find_relevant_sections_batch, find_relevant_sections_streaming, load_model, model_path, refine_sections
+)
+from lexical_index import MODES, RETRIEVAL_MODE
+from vector_index import BruteForceIndex, IVFIndex, build_vector_index, evaluate_recall, load_vector_index
+
+# Bump when the on-disk layout of an index directory changes
+INDEX_VERSION = 4
+# update_index compacts the index once tombstoned rows exceed this fraction of all rows
+COMPACT_DEAD_FRACTION = 0.3
+
+MANIFEST_FILE = "manifest.json"
+CHUNKS_FILE = "chunks.jsonl"
+EMBEDDINGS_FILE = "embeddings.bin"
+SENTENCES_DIR = "sentences"
+
+
+def parse_query(record):
+    """
+    Reads a (persona, job_to_be_done) pair from a query record. Both plain strings and
+    the challenge input form ({"role": ...} / {"task": ...}) are accepted.
+    """
+    persona = record.get("persona", "")
+    job = record.get("job_to_be_done", record.get("job", ""))
+    if isinstance(persona, dict):
+        persona = persona.get("role", "")
+    if isinstance(job, dict):
+        job = job.get("task", "")
+    return persona, job
+
+
+def read_queries(path):
+    """
+    Reads a JSONL file of query records into a list of (persona, job_to_be_done) pairs.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [parse_query(json.loads(line)) for line in f if line.strip()]
+
+
+def _encode_with_store(encode, model_id):
+    """
+    Wraps encode with the shared embedding store, when it is enabled.
+    """
+    store = default_store(model_id)
+    return (lambda texts: store.encode(texts, encode)) if store is not None else encode
+
+
+def _write_index(index_dir, chunks, embeddings, documents, model_id, vector_index, encode_sentences):
+    """
+    Writes a complete index directory next to index_dir and swaps it in, so readers
+    never see a half-written index. vector_index maps the embedding matrix to its
+    vector index; encode_sentences embeds the refinement sentences.
+    """
+    tmp_dir = f"{index_dir.rstrip(os.sep)}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    sentences = list(dict.fromkeys(s for chunk in chunks for s in chunk_sentences(chunk)))
+    EmbeddingStore(tmp_dir, SENTENCES_DIR, dtype="float32").encode(sentences, encode_sentences)
+
+    chunks_bytes = 0
+    with open(os.path.join(tmp_dir, CHUNKS_FILE), "wb") as f:
+        for chunk in chunks:
+            chunks_bytes += f.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8"))
+    embeddings.tofile(os.path.join(tmp_dir, EMBEDDINGS_FILE))
+    vector_index(embeddings).save(tmp_dir)
+
+    manifest = {
+        "version": INDEX_VERSION, "model_id": model_id,
+        "dim": int(embeddings.shape[1]), "dtype": "float32",
+        "chunk_count": len(chunks), "chunks_bytes": chunks_bytes, "dead_chunks": 0,
+        "documents": documents
+    }
+    _write_manifest(tmp_dir, manifest)
+
+    old_dir = f"{index_dir.rstrip(os.sep)}.old-{os.getpid()}"
+    if os.path.exists(index_dir):
+        os.replace(index_dir, old_dir)
+    os.replace(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest
+
+
+def _write_manifest(index_dir, manifest):
+    tmp_path = os.path.join(index_dir, f"{MANIFEST_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(index_dir, MANIFEST_FILE))
+
+
+def build_index(pdf_paths: list, index_dir: str, workers: int = None, vector_index: str = "auto") -> dict:
+    """
+    Runs PDF -> extract_structure -> chunks -> embeddings once and writes a
+    self-contained index directory: the manifest, the chunk metadata and content
+    blocks (one JSON object per line), the chunk embedding matrix, the vector
+    index over it ("flat", "ivf" or "auto") and the embeddings of every
+    refinement sentence. Returns the manifest.
+    """
+    model = load_model()
+    encode_cached = _encode_with_store(lambda texts: encode_texts(model, texts), model.model_id)
+
+    chunks = []
+    documents = []
+    structures = extract_structures(pdf_paths, workers=workers, cache=default_cache())
+    for pdf_path, structure in zip(pdf_paths, structures):
+        if "error" in structure:
+            print(f"Skipping file due to error: {structure['error']}")
+            continue
+        doc_chunks = build_chunks(structure, pdf_path)
+        documents.append({
+            "document": os.path.basename(pdf_path), "path": os.path.abspath(pdf_path),
+            "sha256": file_hash(pdf_path), "chunk_start": len(chunks), "chunk_count": len(doc_chunks)
+        })
+        chunks.extend(doc_chunks)
+
+    if not chunks:
+        raise ValueError("Could not extract any content from the documents.")
+
+    embeddings = np.asarray(encode_cached([chunk["content"] for chunk in chunks]), dtype=np.float32)
+    return _write_index(
+        index_dir, chunks, embeddings, documents, model.model_id,
+        lambda vectors: build_vector_index(vectors, kind=vector_index), encode_cached
+    )
+
+
+def update_index(index_dir: str, pdf_paths: list = (), remove: list = (), workers: int = None,
+                 compact_fraction: float = COMPACT_DEAD_FRACTION) -> dict:
+    """
+    Brings an index up to date without rebuilding it. PDFs new to the index are
+    added. PDFs whose name is already indexed are skipped when their SHA-256 is
+    unchanged; otherwise they replace the old version. Documents named in remove
+    (file names or paths) are dropped.
+
+    Rows of dropped or replaced documents are only tombstoned. New rows are appended
+    to the chunk and embedding files, and only sections whose text is not already in
+    the replaced version are re-embedded. Once tombstones exceed compact_fraction of
+    the rows, the index is compacted. The index expects a single writer at a time.
+    Returns a summary of the update.
+    """
+    index = CorpusIndex(index_dir)
+    manifest = index.manifest
+    documents = list(manifest["documents"])
+    positions = {doc["document"]: i for i, doc in enumerate(documents)}
+    report = {"added": [], "replaced": [], "unchanged": [], "removed": [], "encoded_sections": 0, "reused_sections": 0}
+
+    for name in dict.fromkeys(os.path.basename(path) for path in remove):
+        if name in positions:
+            documents[positions[name]] = None
+            report["removed"].append(name)
+        else:
+            print(f"'{name}' is not in the index, nothing to remove")
+
+    pending = []
+    for pdf_path in dict.fromkeys(pdf_paths):
+        name = os.path.basename(pdf_path)
+        old = documents[positions[name]] if name in positions else None
+        sha256 = file_hash(pdf_path)
+        if old is not None and old["sha256"] == sha256:
+            report["unchanged"].append(name)
+            continue
+        pending.append((pdf_path, sha256, old))
+
+    chunks = []
+    vectors = []
+    to_encode = []
+    structures = extract_structures([path for path, _, _ in pending], workers=workers, cache=default_cache())
+    for (pdf_path, sha256, old), structure in zip(pending, structures):
+        if "error" in structure:
+            print(f"Skipping file due to error: {structure['error']}")
+            continue
+        name = os.path.basename(pdf_path)
+        reusable = {}
+        if old is not None:
+            for row in range(old["chunk_start"], old["chunk_start"] + old["chunk_count"]):
+                reusable.setdefault(index.chunks[row]["content"], row)
+
+        doc_chunks = build_chunks(structure, pdf_path)
+        for chunk in doc_chunks:
+            row = reusable.get(chunk["content"])
+            if row is None:
+                to_encode.append(len(vectors))
+                vectors.append(None)
+            else:
+                vectors.append(np.asarray(index.embeddings[row], dtype=np.float32))
+        entry = {
+            "document": name, "path": os.path.abspath(pdf_path), "sha256": sha256,
+            "chunk_start": manifest["chunk_count"] + len(chunks), "chunk_count": len(doc_chunks)
+        }
+        if old is not None:
+            documents[positions[name]] = entry
+            report["replaced"].append(name)
+        else:
+            positions[name] = len(documents)
+            documents.append(entry)
+            report["added"].append(name)
+        chunks.extend(doc_chunks)
+
+    encode_cached = _encode_with_store(index.encode, manifest["model_id"])
+    if to_encode:
+        encoded = np.asarray(encode_cached([chunks[i]["content"] for i in to_encode]), dtype=np.float32)
+        for i, vector in zip(to_encode, encoded):
+            vectors[i] = vector
+    report["encoded_sections"] = len(to_encode)
+    report["reused_sections"] = len(chunks) - len(to_encode)
+
+    if chunks:
+        sentences = list(dict.fromkeys(s for chunk in chunks for s in chunk_sentences(chunk)))
+        index.sentence_store.encode(sentences, encode_cached)
+
+        # Drop whatever an interrupted update appended past the manifest, then append
+        with open(os.path.join(index_dir, EMBEDDINGS_FILE), "r+b") as f:
+            f.truncate(manifest["chunk_count"] * manifest["dim"] * np.dtype(manifest["dtype"]).itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(np.asarray(vectors, dtype=manifest["dtype"]).tobytes())
+        with open(os.path.join(index_dir, CHUNKS_FILE), "r+b") as f:
+            f.truncate(manifest["chunks_bytes"])
+            f.seek(0, os.SEEK_END)
+            for chunk in chunks:
+                manifest["chunks_bytes"] += f.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8"))
+        manifest["chunk_count"] += len(chunks)
+        index.vector_index.add(np.memmap(
+            os.path.join(index_dir, EMBEDDINGS_FILE), dtype=manifest["dtype"], mode="r",
+            shape=(manifest["chunk_count"], manifest["dim"])
+        ))
+        index.vector_index.save(index_dir)
+
+    manifest["documents"] = [doc for doc in documents if doc is not None]
+    manifest["dead_chunks"] = manifest["chunk_count"] - sum(doc["chunk_count"] for doc in manifest["documents"])
+    _write_manifest(index_dir, manifest)
+
+    report["dead_chunks"] = manifest["dead_chunks"]
+    report["compacted"] = manifest["dead_chunks"] > compact_fraction * max(manifest["chunk_count"], 1)
+    if report["compacted"]:
+        compact_index(index_dir)
+    return report
+
+
+def compact_index(index_dir: str) -> dict:
+    """
+    Rewrites an index without its tombstoned rows and unused sentence embeddings.
+    Nothing is re-embedded, and an IVF index keeps its trained lists. Returns the new manifest.
+    """
+    index = CorpusIndex(index_dir)
+    rows = np.concatenate([
+        np.arange(doc["chunk_start"], doc["chunk_start"] + doc["chunk_count"]) for doc in index.manifest["documents"]
+    ] or [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+    documents = []
+    for doc in index.manifest["documents"]:
+        documents.append(dict(doc, chunk_start=sum(d["chunk_count"] for d in documents)))
+
+    old_index = index.vector_index
+    if old_index.kind == "ivf":
+        def vector_index(vectors):
+            return IVFIndex(vectors, old_index.centroids, old_index.assignments[rows], nprobe=old_index.nprobe)
+    else:
+        vector_index = BruteForceIndex
+
+    return _write_index(
+        index_dir, [index.chunks[row] for row in rows], np.asarray(index.embeddings[rows], dtype=np.float32),
+        documents, index.manifest["model_id"], vector_index, index.encode_sentences
+    )
+
+
+class CorpusIndex:
+    """
+    A loaded index directory. The embedding matrix is memory-mapped, so loading is
+    cheap and each query costs one query encode, one matrix product and a lookup of
+    the precomputed sentence embeddings of the top sections.
+    """
+
+    def __init__(self, index_dir: str, model=None):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != INDEX_VERSION:
+            raise ValueError(f"Index '{index_dir}' has version {self.manifest.get('version')}, expected {INDEX_VERSION}. Rebuild it.")
+        if self.manifest["model_id"] != embedding_model_id(model_path, resolve_backend(model_path)):
+            raise ValueError(f"Index '{index_dir}' was built with a different model or backend than '{model_path}'. Rebuild it.")
+
+        # Rows past chunk_count belong to an update that never committed its manifest
+        chunk_count = self.manifest["chunk_count"]
+        with open(os.path.join(index_dir, CHUNKS_FILE), "r", encoding="utf-8") as f:
+            self.chunks = [json.loads(line) for line in itertools.islice(f, chunk_count)]
+        self.embeddings = np.memmap(
+            os.path.join(index_dir, EMBEDDINGS_FILE), dtype=self.manifest["dtype"], mode="r",
+            shape=(chunk_count, self.manifest["dim"])
+        ) if chunk_count else np.zeros((0, self.manifest["dim"]), dtype=self.manifest["dtype"])
+        self.vector_index = load_vector_index(index_dir, self.embeddings)
+        if self.manifest.get("dead_chunks"):
+            live = np.zeros(chunk_count, dtype=bool)
+            for doc in self.manifest["documents"]:
+                live[doc["chunk_start"]:doc["chunk_start"] + doc["chunk_count"]] = True
+            self.vector_index.remove(np.flatnonzero(~live))
+        self.sentence_store = EmbeddingStore(index_dir, SENTENCES_DIR)
+        self._model = model
+
+    @property
+    def documents(self):
+        return [doc["document"] for doc in self.manifest["documents"]]
+
+    def encode(self, texts):
+        if self._model is None:
+            self._model = load_model()
+        return encode_texts(self._model, texts)
+
+    def encode_sentences(self, sentences):
+        return self.sentence_store.encode(sentences, self.encode)
+
+    def query(self, persona: str, job_to_be_done: str, top_k: int = TOP_K) -> dict:
+        """
+        Answers one persona/job query in the find_relevant_sections output schema.
+        """
+        return self.query_batch([(persona, job_to_be_done)], top_k=top_k)[0]
+
+    def query_batch(self, queries: list, top_k: int = TOP_K) -> list:
+        """
+        Answers many (persona, job_to_be_done) pairs with one batched query encode,
+        one (queries x chunks) matrix product and a shared sentence refinement.
+        """
+        query_embeddings = self.encode([build_query(persona, job) for persona, job in queries])
+        _, top_indices = self.vector_index.search(query_embeddings, top_k)
+        ranked = refine_sections(query_embeddings, self.chunks, top_indices, self.encode_sentences)
+        return [
+            build_output(self.documents, persona, job, extracted_sections, sub_section_analysis)
+            for (persona, job), (extracted_sections, sub_section_analysis) in zip(queries, ranked)
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a corpus index once, then query it many times.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Extract, chunk and embed PDFs into an index directory.")
+    build_parser.add_argument("--index", required=True, help="Index directory to (re)create.")
+    build_parser.add_argument("--workers", type=int, default=None, help="PDF parsing processes.")
+    build_parser.add_argument("--vector-index", choices=["auto", "flat", "ivf"], default="auto",
+                              help="Exact (flat) or approximate (ivf) search; auto uses IVF for large corpora.")
+    build_parser.add_argument("pdfs", nargs="+", help="PDF files to index.")
+
+    query_parser = subparsers.add_parser("query", help="Rank the sections of an index for a persona and job.")
+    query_parser.add_argument("--index", required=True, help="Index directory built with 'build'.")
+    query_parser.add_argument("--persona", required=True)
+    query_parser.add_argument("--job", required=True, help="The job to be done.")
+    query_parser.add_argument("--top-k", type=int, default=TOP_K)
+    query_parser.add_argument("--output", help="Write the JSON result here instead of stdout.")
+
+    batch_parser = subparsers.add_parser("batch", help="Answer a JSONL file of persona/job queries in one pass.")
+    source = batch_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--index", help="Index directory built with 'build'.")
+    source.add_argument("--pdfs", nargs="+", help="PDF files to analyze directly, without an index.")
+    batch_parser.add_argument("--queries", required=True, help="JSONL file, one {\"persona\", \"job_to_be_done\"} per line.")
+    batch_parser.add_argument("--top-k", type=int, default=TOP_K)
+    batch_parser.add_argument("--mode", choices=MODES, default=RETRIEVAL_MODE,
+                              help="With --pdfs: semantic, BM25-filtered or hybrid retrieval.")
+    batch_parser.add_argument("--stream", action="store_true",
+                              help="With --pdfs: bounded-memory streaming over pages and chunks.")
+    batch_parser.add_argument("--batch-size", type=int, default=STREAM_BATCH_SIZE, help="Chunks embedded per streaming batch.")
+    batch_parser.add_argument("--output", required=True, help="JSONL file receiving one result per query, in order.")
+
+    update_parser = subparsers.add_parser("update", help="Add, replace or remove documents without a full rebuild.")
+    update_parser.add_argument("--index", required=True, help="Index directory built with 'build'.")
+    update_parser.add_argument("--remove", action="append", default=[],
+                               help="Document name (or path) to drop; repeat the flag for several.")
+    update_parser.add_argument("--workers", type=int, default=None, help="PDF parsing processes.")
+    update_parser.add_argument("pdfs", nargs="*", help="PDF files to add, or to replace when their content changed.")
+
+    compact_parser = subparsers.add_parser("compact", help="Reclaim the space of removed and replaced documents.")
+    compact_parser.add_argument("--index", required=True)
+
+    recall_parser = subparsers.add_parser("recall", help="Measure recall@k of the index's vector search against exact search.")
+    recall_parser.add_argument("--index", required=True)
+    recall_parser.add_argument("--queries", help="JSONL of persona/job queries (default: a sample of the indexed sections).")
+    recall_parser.add_argument("--k", type=int, default=5)
+    recall_parser.add_argument("--nprobe", type=int, nargs="*", help="IVF nprobe values to compare.")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        manifest = build_index(args.pdfs, args.index, workers=args.workers, vector_index=args.vector_index)
+        print(f"Indexed {manifest['chunk_count']} sections from {len(manifest['documents'])} document(s) into '{args.index}'")
+    elif args.command == "update":
+        print(json.dumps(update_index(args.index, args.pdfs, remove=args.remove, workers=args.workers), indent=2))
+    elif args.command == "compact":
+        manifest = compact_index(args.index)
+        print(f"Compacted '{args.index}' to {manifest['chunk_count']} sections from {len(manifest['documents'])} document(s)")
+    elif args.command == "query":
+        result = CorpusIndex(args.index).query(args.persona, args.job, top_k=args.top_k)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=4)
+        else:
+            print(json.dumps(result, indent=2))
+    elif args.command == "recall":
+        index = CorpusIndex(args.index)
+        if args.queries:
+            queries = index.encode([build_query(persona, job) for persona, job in read_queries(args.queries)])
+        else:
+            sample = np.random.default_rng(0).choice(len(index.chunks), size=min(200, len(index.chunks)), replace=False)
+            queries = np.asarray(index.embeddings[np.sort(sample)])
+        print(json.dumps(evaluate_recall(index.vector_index, queries, args.k, args.nprobe), indent=2))
+    elif args.command == "batch":
+        queries = read_queries(args.queries)
+        if args.index:
+            results = CorpusIndex(args.index).query_batch(queries, top_k=args.top_k)
+        elif args.stream:
+            results = find_relevant_sections_streaming(args.pdfs, queries, top_k=args.top_k, batch_size=args.batch_size)
+        else:
+            results = find_relevant_sections_batch(args.pdfs, queries, mode=args.mode, top_k=args.top_k)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        print(f"Answered {len(results)} queries into '{args.output}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import os
+import zlib
+
+import numpy as np
+
+from instrumentation import count
+
+# Set DEDUP=1 to embed each group of near-duplicate chunks once; it can change the ranking, so it is opt-in
+DEDUP = os.environ.get("DEDUP", "0") == "1"
+# Estimated Jaccard similarity of word shingles above which two chunks count as copies
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.9"))
+# Rank only the first chunk (in document order) of each duplicate group, dropping its copies before ranking
+DEDUP_COLLAPSE = os.environ.get("DEDUP_COLLAPSE", "0") == "1"
+# MinHash signature length, split into LSH bands of MINHASH_ROWS rows
+MINHASH_PERMUTATIONS = 64
+MINHASH_ROWS = 4
+SHINGLE_WORDS = 3
+
+_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, 1 << 31, MINHASH_PERMUTATIONS).astype(np.uint64)
+_B = _rng.randint(0, 1 << 31, MINHASH_PERMUTATIONS).astype(np.uint64)
+
+
+def shingle_hashes(text, k=SHINGLE_WORDS):
+    """
+    CRC32 hashes of the text's k-word shingles (case-folded, whitespace-normalized).
+    A text shorter than k words is one shingle.
+    """
+    words = text.lower().split()
+    grams = [" ".join(words[i:i + k]) for i in range(max(len(words) - k + 1, 1))]
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams)))
+
+
+def minhash_signatures(texts):
+    """
+    (len(texts), MINHASH_PERMUTATIONS) MinHash signatures: the minimum of each
+    universal hash (a * h + b) mod p over a text's shingle hashes. The fraction of
+    equal positions between two signatures estimates their Jaccard similarity.
+    """
+    signatures = np.empty((len(texts), MINHASH_PERMUTATIONS), dtype=np.uint64)
+    for i, text in enumerate(texts):
+        hashes = shingle_hashes(text)
+        signatures[i] = ((hashes[:, None] * _A + _B) % _PRIME).min(axis=0)
+    return signatures
+
+
+def duplicate_groups(texts, threshold=DEDUP_THRESHOLD):
+    """
+    Maps every text to the index of the first text of its near-duplicate group
+    (itself when it is unique). Candidates come from LSH: texts sharing one band of
+    MINHASH_ROWS signature rows. A candidate joins a group when its estimated
+    Jaccard similarity to the bucket's first text reaches threshold. Comparing
+    against that first text only keeps large groups of copies linear.
+    """
+    parent = np.arange(len(texts))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if len(texts) < 2:
+        return parent
+    signatures = minhash_signatures(texts)
+    for start in range(0, MINHASH_PERMUTATIONS, MINHASH_ROWS):
+        band = np.ascontiguousarray(signatures[:, start:start + MINHASH_ROWS])
+        buckets = {}
+        for i in range(len(texts)):
+            first = buckets.setdefault(band[i].tobytes(), i)
+            if first == i:
+                continue
+            a, b = find(first), find(i)
+            if a != b and np.mean(signatures[first] == signatures[i]) >= threshold:
+                parent[max(a, b)] = min(a, b)
+    return np.array([find(i) for i in range(len(texts))])
+
+
+class DedupEncoder:
+    """
+    Wraps an encode function (list of texts -> 2D array) so that each distinct text is
+    encoded once per call and every near-duplicate chunk content is encoded as its
+    group's first content; the vectors are fanned back out to every copy.
+    saved counts the encodes avoided.
+    """
+
+    def __init__(self, encode, canonical=None):
+        self.encode = encode
+        self.canonical = canonical or {}
+        self.saved = 0
+
+    def __call__(self, texts):
+        texts = [self.canonical.get(text, text) for text in texts]
+        rows = {}
+        positions = [rows.setdefault(text, len(rows)) for text in texts]
+        saved = len(texts) - len(rows)
+        self.saved += saved
+        count("dedup.encodes_saved", saved)
+        vectors = np.asarray(self.encode(list(rows)))
+        return vectors[positions] if saved else vectors
+
+
+def deduplicate(chunks, encode, collapse=DEDUP_COLLAPSE, threshold=DEDUP_THRESHOLD):
+    """
+    The dedup stage between chunking and embedding. Groups near-duplicate chunks
+    (boilerplate repeated across documents, such as disclaimers or template sections)
+    and returns (chunks, encode). encode is a DedupEncoder that embeds each group
+    once. With collapse, only the first chunk of each group is kept, so copies
+    cannot fill several of the top ranks.
+    """
+    groups = duplicate_groups([chunk["content"] for chunk in chunks], threshold)
+    duplicates = int((groups != np.arange(len(chunks))).sum())
+    count("dedup.duplicate_chunks", duplicates)
+    canonical = {
+        chunk["content"]: chunks[group]["content"]
+        for chunk, group in zip(chunks, groups.tolist()) if chunk["content"] != chunks[group]["content"]
+    }
+    encoder = DedupEncoder(encode, canonical)
+    if collapse and duplicates:
+        chunks = [chunk for i, (chunk, group) in enumerate(zip(chunks, groups.tolist())) if i == group]
+        # The dropped copies are never encoded
+        encoder.saved = duplicates
+        count("dedup.encodes_saved", duplicates)
+    return chunks, encoder
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from instrumentation import count
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-writer use only
+    fcntl = None
+
+# Root of the persistent embedding store; set EMBEDDING_STORE_DIR to an empty string to disable it
+STORE_DIR = os.environ.get(
+    "EMBEDDING_STORE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "persona-doc-intel", "embeddings")
+)
+# Storage precision of the vectors: "float32" (default) or "float16" to halve the footprint
+STORE_DTYPE = os.environ.get("EMBEDDING_STORE_DTYPE", "float32")
+
+# Files smaller than this are hashed in full when fingerprinting a model directory
+_FULL_HASH_LIMIT = 4 * 1024 * 1024
+
+
+def model_fingerprint(model_path):
+    """
+    Identifies a saved model by its file names and sizes, plus the full contents of
+    small files (configs, tokenizer) and the first block of large ones (weights).
+    Exported ONNX graphs are derived from the weights and left out.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(model_path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith((".md", ".onnx")):
+                continue
+            path = os.path.join(root, name)
+            size = os.path.getsize(path)
+            digest.update(f"{os.path.relpath(path, model_path)}\0{size}\0".encode("utf-8"))
+            with open(path, "rb") as f:
+                digest.update(f.read(_FULL_HASH_LIMIT))
+    return digest.hexdigest()[:16]
+
+
+def text_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Append-only, memory-mapped store of text embeddings for one model.
+    Vectors live in a raw float32/float16 matrix (vectors.bin) and the side
+    index (keys.txt) holds one text hash per row, in row order.
+    """
+
+    def __init__(self, store_dir: str, model_id: str, dtype: str = STORE_DTYPE):
+        self.dir = os.path.join(store_dir, model_id)
+        os.makedirs(self.dir, exist_ok=True)
+        self.model_id = model_id
+        self._meta_path = os.path.join(self.dir, "meta.json")
+        self._keys_path = os.path.join(self.dir, "keys.txt")
+        self._vectors_path = os.path.join(self.dir, "vectors.bin")
+        self._lock_path = os.path.join(self.dir, ".lock")
+
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dtype = np.dtype(meta["dtype"])
+            self.dim = meta["dim"]
+        else:
+            self.dtype = np.dtype(dtype)
+            self.dim = None
+
+        self._rows = {}
+        self._matrix = None
+        # One store is shared by the threads of a process (see default_store)
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _load(self):
+        """
+        (Re)reads the side index and maps the vector matrix. Rows written without a
+        matching key (an interrupted append) are ignored.
+        """
+        if self.dim is None or not os.path.exists(self._keys_path):
+            return
+        with open(self._keys_path, "r", encoding="utf-8") as f:
+            keys = f.read().split()
+        row_bytes = self.dim * self.dtype.itemsize
+        rows = min(len(keys), os.path.getsize(self._vectors_path) // row_bytes)
+        self._rows = {key: i for i, key in enumerate(keys[:rows])}
+        self._matrix = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(rows, self.dim)) if rows else None
+
+    def _append(self, keys, vectors):
+        with open(self._lock_path, "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if self.dim is None:
+                    self.dim = int(vectors.shape[1])
+                    with open(self._meta_path, "w", encoding="utf-8") as f:
+                        json.dump({"model_id": self.model_id, "dim": self.dim, "dtype": self.dtype.name}, f)
+                # Another process may have appended since we loaded: pick up its rows first
+                self._load()
+                fresh = [i for i, key in enumerate(keys) if key not in self._rows]
+                if fresh:
+                    # Vectors before keys, so a crash can only leave unindexed rows behind
+                    with open(self._vectors_path, "ab") as f:
+                        f.write(np.ascontiguousarray(vectors[fresh], dtype=self.dtype).tobytes())
+                    with open(self._keys_path, "a", encoding="utf-8") as f:
+                        f.write("".join(f"{keys[i]}\n" for i in fresh))
+                self._load()
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def encode(self, texts: list, encode_fn) -> np.ndarray:
+        """
+        Returns a float32 (len(texts), dim) matrix for texts. Only texts missing from
+        the store are passed to encode_fn (list of str -> 2D array), and their vectors are persisted.
+        """
+        keys = [text_key(text) for text in texts]
+        with self._lock:
+            missing = list(dict.fromkeys(
+                (key, text) for key, text in zip(keys, texts) if key not in self._rows
+            ))
+        count("embedding_store.hits", len(keys) - len(missing))
+        count("embedding_store.misses", len(missing))
+        if missing:
+            vectors = np.asarray(encode_fn([text for _, text in missing]), dtype=np.float32)
+            with self._lock:
+                self._append([key for key, _ in missing], vectors)
+
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        with self._lock:
+            rows = np.fromiter((self._rows[key] for key in keys), dtype=np.int64, count=len(keys))
+            return np.asarray(self._matrix[rows], dtype=np.float32)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def default_store(model_id):
+    """
+    Returns the EmbeddingStore for model_id (an encoder's model_id), or None when the store is disabled or unusable.
+    Stores are opened once per process, so later calls reuse the loaded index and memmap;
+    rows appended by other processes are picked up at the next append.
+    """
+    if not STORE_DIR:
+        return None
+    with _stores_lock:
+        key = (STORE_DIR, model_id)
+        if key not in _stores:
+            try:
+                _stores[key] = EmbeddingStore(STORE_DIR, model_id)
+            except OSError as e:
+                print(f"Embedding store disabled, could not use '{STORE_DIR}': {e}")
+                return None
+        return _stores[key]
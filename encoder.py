@@ -0,0 +1,427 @@
+import argparse
+import json
+import math
+import os
+import struct
+
+import numpy as np
+
+from batching import WINDOW_OVERLAP
+from embedding_store import model_fingerprint
+
+# Which inference backend encodes text:
+#   "auto"                  - "onnx" when an exported model.onnx is present, else "sentence-transformers"
+#   "sentence-transformers" - the original torch path
+#   "onnx"                  - onnxruntime on the exported graph, no torch import
+#   "numpy"                 - a pure NumPy forward pass over model.safetensors, no torch import
+#   "onnx-int8"             - onnxruntime on the int8 dynamically quantized graph (see quantization.py)
+#   "sentence-transformers-int8" - torch dynamic int8 quantization of the Linear layers
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "auto")
+
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+SAFETENSORS_FILE = "model.safetensors"
+
+# Maximum absolute per-dimension difference tolerated between a backend and sentence-transformers
+EQUIVALENCE_TOLERANCE = 1e-4
+
+
+def _read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def embedding_model_id(model_path, backend):
+    """
+    Identifies the vectors a backend produces. The fp32 backends are numerically
+    equivalent and share one id; each quantized backend gets its own, since
+    onnx-int8 and sentence-transformers-int8 quantize differently. The window
+    overlap used to pool long texts is part of the id as well.
+    """
+    fingerprint = model_fingerprint(model_path)
+    if backend.endswith("-int8"):
+        fingerprint = f"{fingerprint}-{backend}"
+    return f"{fingerprint}-w{WINDOW_OVERLAP}"
+
+
+class SentenceTransformerEncoder:
+    """
+    The original torch path. sentence_transformers (and torch) are only imported here.
+    """
+    name = "sentence-transformers"
+
+    def __init__(self, model_path):
+        from sentence_transformers import SentenceTransformer
+        self.model_path = model_path
+        self.model_id = embedding_model_id(model_path, self.name)
+        self.model = SentenceTransformer(model_path)
+        self.max_seq_length = self.model.max_seq_length
+        self.cls_id = self.model.tokenizer.cls_token_id
+        self.sep_id = self.model.tokenizer.sep_token_id
+
+    def encode(self, texts, batch_size=32):
+        return self.model.encode(
+            list(texts), batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32, copy=False)
+
+    def token_ids(self, texts):
+        """
+        Token ids of texts without special tokens and without truncation.
+        """
+        return self.model.tokenizer(list(texts), add_special_tokens=False, verbose=False)["input_ids"]
+
+    def embed_ids(self, input_ids, attention_mask):
+        """
+        Normalized embeddings of already tokenized, padded sequences.
+        """
+        import torch
+
+        device = self.model.device
+        features = {
+            "input_ids": torch.as_tensor(input_ids, device=device),
+            "attention_mask": torch.as_tensor(attention_mask, device=device),
+            "token_type_ids": torch.zeros(input_ids.shape, dtype=torch.long, device=device)
+        }
+        with torch.inference_mode():
+            pooled = self.model(features)["sentence_embedding"].float().cpu().numpy()
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+
+class QuantizedSentenceTransformerEncoder(SentenceTransformerEncoder):
+    """
+    The torch path with every nn.Linear dynamically quantized to int8 on load.
+    """
+    name = "sentence-transformers-int8"
+
+    def __init__(self, model_path):
+        super().__init__(model_path)
+        import torch
+        # Dynamic quantization only runs on CPU
+        self.model = torch.ao.quantization.quantize_dynamic(self.model.to("cpu"), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class _TorchFreeEncoder:
+    """
+    Shared tokenization, mean pooling and normalization for the torch-free backends,
+    following the saved model's sentence_bert_config.json and 1_Pooling/config.json.
+    Subclasses implement _forward(input_ids, attention_mask, token_type_ids) -> token embeddings.
+    """
+
+    def __init__(self, model_path):
+        from tokenizers import Tokenizer
+
+        self.model_path = model_path
+        self.model_id = embedding_model_id(model_path, self.name)
+        self.max_seq_length = _read_json(os.path.join(model_path, "sentence_bert_config.json"))["max_seq_length"]
+        pooling = _read_json(os.path.join(model_path, "1_Pooling", "config.json"))
+        if not pooling.get("pooling_mode_mean_tokens"):
+            raise ValueError(f"Only mean pooling is supported by the {self.name} backend.")
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        # tokenizer.json ships with fixed 128-token padding; match sentence-transformers instead
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        # Separate instance for raw token ids: no padding, truncation or special tokens
+        self._raw_tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self._raw_tokenizer.no_padding()
+        self._raw_tokenizer.no_truncation()
+        self.cls_id = self.tokenizer.token_to_id("[CLS]")
+        self.sep_id = self.tokenizer.token_to_id("[SEP]")
+
+    def tokenize(self, texts):
+        encodings = self.tokenizer.encode_batch(list(texts))
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        token_type_ids = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        return input_ids, attention_mask, token_type_ids
+
+    def token_ids(self, texts):
+        """
+        Token ids of texts without special tokens and without truncation.
+        """
+        return [e.ids for e in self._raw_tokenizer.encode_batch(list(texts), add_special_tokens=False)]
+
+    def embed_ids(self, input_ids, attention_mask):
+        """
+        Mean-pooled, normalized embeddings of already tokenized, padded sequences.
+        """
+        token_embeddings = self._forward(input_ids, attention_mask, np.zeros_like(input_ids))
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def encode(self, texts, batch_size=32):
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        # Sort by length so each batch pads to a similar size, then restore input order
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        out = [None] * len(texts)
+        for start in range(0, len(texts), batch_size):
+            idx = order[start:start + batch_size]
+            input_ids, attention_mask, _ = self.tokenize([texts[i] for i in idx])
+            pooled = self.embed_ids(input_ids, attention_mask)
+            for row, i in enumerate(idx):
+                out[i] = pooled[row]
+        return np.stack(out).astype(np.float32, copy=False)
+
+
+class OnnxEncoder(_TorchFreeEncoder):
+    """
+    Runs the graph written by export_onnx with onnxruntime.
+    """
+    name = "onnx"
+
+    def __init__(self, model_path, onnx_file=ONNX_FILE):
+        super().__init__(model_path)
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_path, onnx_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _forward(self, input_ids, attention_mask, token_type_ids):
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": token_type_ids}
+        feeds = {k: v for k, v in feeds.items() if k in self.input_names}
+        return self.session.run(None, feeds)[0]
+
+
+class QuantizedOnnxEncoder(OnnxEncoder):
+    """
+    Runs the int8 dynamically quantized graph written by quantization.quantize_onnx.
+    """
+    name = "onnx-int8"
+
+    def __init__(self, model_path):
+        super().__init__(model_path, onnx_file=ONNX_INT8_FILE)
+
+
+def load_safetensors(path):
+    """
+    Reads a .safetensors file into a dict of float32 NumPy arrays without torch or the safetensors package.
+    """
+    dtypes = {"F32": np.float32, "F16": np.float16, "BF16": np.uint16, "I64": np.int64}
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    data = np.memmap(path, dtype=np.uint8, mode="r", offset=8 + header_size)
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__" or info["dtype"] not in dtypes:
+            continue
+        start, end = info["data_offsets"]
+        array = np.frombuffer(data[start:end], dtype=dtypes[info["dtype"]]).reshape(info["shape"])
+        if info["dtype"] == "BF16":
+            array = (array.astype(np.uint32) << 16).view(np.float32)
+        if array.dtype != np.int64:
+            array = array.astype(np.float32)
+        # Checkpoints saved from a task head prefix the encoder weights with "bert."
+        tensors[name[len("bert."):] if name.startswith("bert.") else name] = array
+    return tensors
+
+
+def _erf(x):
+    # Abramowitz & Stegun 7.1.26; absolute error below 1.5e-7, well inside EQUIVALENCE_TOLERANCE
+    sign = np.sign(x)
+    x = np.abs(x)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    y = 1.0 - (((((1.061405429 * t - 1.453152027) * t) + 1.421413741) * t - 0.284496736) * t + 0.254829592) * t * np.exp(-x * x)
+    return sign * y
+
+
+def _gelu(x):
+    return 0.5 * x * (1.0 + _erf(x / math.sqrt(2.0)))
+
+
+def _layer_norm(x, weight, bias, eps):
+    mean = x.mean(axis=-1, keepdims=True)
+    var = ((x - mean) ** 2).mean(axis=-1, keepdims=True)
+    return (x - mean) / np.sqrt(var + eps) * weight + bias
+
+
+class NumpyEncoder(_TorchFreeEncoder):
+    """
+    A BERT encoder forward pass in NumPy over the weights in model.safetensors.
+    Slower per batch than onnxruntime, but needs nothing beyond numpy and tokenizers.
+    """
+    name = "numpy"
+
+    def __init__(self, model_path):
+        super().__init__(model_path)
+        config = _read_json(os.path.join(model_path, "config.json"))
+        if config.get("hidden_act", "gelu") != "gelu" or config.get("position_embedding_type", "absolute") != "absolute":
+            raise ValueError("The numpy backend only supports BERT models with gelu and absolute positions.")
+        self.num_heads = config["num_attention_heads"]
+        self.num_layers = config["num_hidden_layers"]
+        self.eps = config.get("layer_norm_eps", 1e-12)
+
+        w = load_safetensors(os.path.join(model_path, SAFETENSORS_FILE))
+        self.embeddings = (
+            w["embeddings.word_embeddings.weight"], w["embeddings.position_embeddings.weight"],
+            w["embeddings.token_type_embeddings.weight"],
+            w["embeddings.LayerNorm.weight"], w["embeddings.LayerNorm.bias"]
+        )
+        self.layers = []
+        for i in range(self.num_layers):
+            p = f"encoder.layer.{i}."
+            # Linear weights are stored (out, in); transpose once so the forward pass is x @ W
+            self.layers.append({
+                "qkv_w": np.concatenate([w[p + f"attention.self.{n}.weight"] for n in ("query", "key", "value")]).T.copy(),
+                "qkv_b": np.concatenate([w[p + f"attention.self.{n}.bias"] for n in ("query", "key", "value")]),
+                "attn_out_w": w[p + "attention.output.dense.weight"].T.copy(),
+                "attn_out_b": w[p + "attention.output.dense.bias"],
+                "attn_ln_w": w[p + "attention.output.LayerNorm.weight"],
+                "attn_ln_b": w[p + "attention.output.LayerNorm.bias"],
+                "inter_w": w[p + "intermediate.dense.weight"].T.copy(),
+                "inter_b": w[p + "intermediate.dense.bias"],
+                "out_w": w[p + "output.dense.weight"].T.copy(),
+                "out_b": w[p + "output.dense.bias"],
+                "out_ln_w": w[p + "output.LayerNorm.weight"],
+                "out_ln_b": w[p + "output.LayerNorm.bias"],
+            })
+
+    def _forward(self, input_ids, attention_mask, token_type_ids):
+        word, position, token_type, ln_w, ln_b = self.embeddings
+        batch, length = input_ids.shape
+        x = word[input_ids] + position[np.arange(length)][None] + token_type[token_type_ids]
+        x = _layer_norm(x, ln_w, ln_b, self.eps)
+
+        hidden = x.shape[-1]
+        head_dim = hidden // self.num_heads
+        mask_bias = ((1.0 - attention_mask[:, None, None, :]) * np.finfo(np.float32).min).astype(np.float32)
+
+        for layer in self.layers:
+            qkv = x @ layer["qkv_w"] + layer["qkv_b"]
+            qkv = qkv.reshape(batch, length, 3, self.num_heads, head_dim).transpose(2, 0, 3, 1, 4)
+            q, k, v = qkv[0], qkv[1], qkv[2]
+            scores = (q @ k.transpose(0, 1, 3, 2)) / math.sqrt(head_dim) + mask_bias
+            scores -= scores.max(axis=-1, keepdims=True)
+            probs = np.exp(scores)
+            probs /= probs.sum(axis=-1, keepdims=True)
+            context = (probs @ v).transpose(0, 2, 1, 3).reshape(batch, length, hidden)
+
+            x = _layer_norm(context @ layer["attn_out_w"] + layer["attn_out_b"] + x, layer["attn_ln_w"], layer["attn_ln_b"], self.eps)
+            intermediate = _gelu(x @ layer["inter_w"] + layer["inter_b"])
+            x = _layer_norm(intermediate @ layer["out_w"] + layer["out_b"] + x, layer["out_ln_w"], layer["out_ln_b"], self.eps)
+        return x
+
+
+def onnxruntime_available():
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_backend(model_path, backend=None):
+    """
+    Turns "auto" (or None) into a concrete backend name for model_path.
+    """
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "auto":
+        if os.path.exists(os.path.join(model_path, ONNX_FILE)) and onnxruntime_available():
+            return "onnx"
+        return "sentence-transformers"
+    return backend
+
+
+def get_encoder(model_path, backend=None):
+    """
+    Builds the encoder for model_path. Every backend returns L2-normalized float32
+    NumPy embeddings from encode(texts).
+    """
+    backend = resolve_backend(model_path, backend)
+    if backend == "sentence-transformers":
+        return SentenceTransformerEncoder(model_path)
+    if backend == "onnx":
+        return OnnxEncoder(model_path)
+    if backend == "numpy":
+        return NumpyEncoder(model_path)
+    if backend == "onnx-int8":
+        return QuantizedOnnxEncoder(model_path)
+    if backend == "sentence-transformers-int8":
+        return QuantizedSentenceTransformerEncoder(model_path)
+    raise ValueError(f"Unknown embedding backend '{backend}'")
+
+
+def export_onnx(model_path, output_path=None, opset=17):
+    """
+    Exports the transformer of the saved model to ONNX (token embeddings output).
+    Needs torch and transformers, so run it once at build time, not in the serving container.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    class TokenEmbeddings(torch.nn.Module):
+        # Fixes the argument order and output, whatever the transformers version's forward() looks like
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.transformer(
+                input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+            ).last_hidden_state
+
+    output_path = output_path or os.path.join(model_path, ONNX_FILE)
+    model = TokenEmbeddings(AutoModel.from_pretrained(model_path))
+    model.eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    sample = tokenizer(["An example sentence for export."], return_tensors="pt")
+    inputs = (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"])
+    dynamic = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model, inputs, output_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": dynamic, "attention_mask": dynamic, "token_type_ids": dynamic, "last_hidden_state": dynamic},
+            opset_version=opset, dynamo=False
+        )
+    return output_path
+
+
+VERIFY_TEXTS = [
+    "Persona: An investment analyst with expertise in the tech sector. Task: Analyze revenue trends.",
+    "R&D investments grew by 30% to fuel innovation in AI.",
+    "1.1 Prior Research",
+    "Graph neural networks provide a flexible framework for non-euclidean data like molecules. " * 12,
+]
+
+
+def verify_backend(model_path, backend, texts=VERIFY_TEXTS, tolerance=EQUIVALENCE_TOLERANCE):
+    """
+    Compares a backend's embeddings with sentence-transformers on texts.
+    Returns a report with the largest absolute difference and the lowest cosine similarity.
+    """
+    reference = SentenceTransformerEncoder(model_path).encode(texts)
+    candidate = get_encoder(model_path, backend).encode(texts)
+    max_abs_diff = float(np.abs(reference - candidate).max())
+    min_cosine = float((reference * candidate).sum(axis=1).min())
+    return {
+        "backend": backend, "texts": len(texts), "max_abs_diff": max_abs_diff,
+        "min_cosine": min_cosine, "tolerance": tolerance, "equivalent": max_abs_diff <= tolerance
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export and verify the torch-free embedding backends.")
+    parser.add_argument("--model-path", default="./model")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export-onnx", help="Write model.onnx next to the saved model (needs torch).")
+    export_parser.add_argument("--output", default=None)
+    verify_parser = subparsers.add_parser("verify", help="Check a backend against sentence-transformers.")
+    verify_parser.add_argument("--backend", choices=["onnx", "numpy"], required=True)
+    args = parser.parse_args()
+
+    if args.command == "export-onnx":
+        print(f"Exported ONNX graph to '{export_onnx(args.model_path, args.output)}'")
+    elif args.command == "verify":
+        report = verify_backend(args.model_path, args.backend)
+        print(json.dumps(report, indent=2))
+        raise SystemExit(0 if report["equivalent"] else 1)
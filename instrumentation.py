@@ -0,0 +1,224 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Append one JSON line per finished run to this file; empty disables
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+# Rewrite this file with the process's cumulative metrics in Prometheus text format after each run; empty disables
+PROMETHEUS_FILE = os.environ.get("METRICS_PROMETHEUS_FILE", "")
+# Write a cProfile dump of every run into this directory; empty disables
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "")
+
+METRIC_PREFIX = "docintel"
+
+
+class Metrics:
+    """
+    Stage timers (call count and total seconds) and named counters.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            count, total = self.timers.get(stage, (0, 0.0))
+            self.timers[stage] = (count + 1, total + seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "timers": {stage: {"count": c, "seconds": round(s, 6)} for stage, (c, s) in self.timers.items()},
+                "counters": dict(self.counters)
+            }
+
+    def merge(self, snapshot):
+        with self._lock:
+            for stage, timer in snapshot["timers"].items():
+                count, total = self.timers.get(stage, (0, 0.0))
+                self.timers[stage] = (count + timer["count"], total + timer["seconds"])
+            for name, value in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+
+# Cumulative metrics of this process
+registry = Metrics()
+# Where timers and counters currently record: the registry, plus the metrics of any active run
+_sinks = contextvars.ContextVar("metric_sinks", default=(registry,))
+_documents = contextvars.ContextVar("run_documents", default=None)
+_write_lock = threading.Lock()
+
+
+def enabled():
+    """
+    True when metrics are exported somewhere, so optional extra measurements are worth their cost.
+    """
+    return bool(METRICS_FILE or PROMETHEUS_FILE)
+
+
+@contextmanager
+def timer(stage):
+    """
+    Times the enclosed block as one call of stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        for sink in _sinks.get():
+            sink.observe(stage, seconds)
+
+
+def count(name, value=1):
+    for sink in _sinks.get():
+        sink.count(name, value)
+
+
+def merge(snapshot):
+    """
+    Adds metrics recorded elsewhere (e.g. returned by a pool worker) to the current sinks.
+    """
+    for sink in _sinks.get():
+        sink.merge(snapshot)
+
+
+def capture(fn, *args):
+    """
+    Calls fn(*args) recording its metrics apart, and returns (result, snapshot).
+    Pool workers use it to ship their stage timings back to the parent.
+    """
+    local = Metrics()
+    token = _sinks.set((local,))
+    try:
+        result = fn(*args)
+    finally:
+        _sinks.reset(token)
+    return result, local.snapshot()
+
+
+def record_document(document, **stats):
+    """
+    Attaches per-document stats (pages, blocks, headings, chunks, tokens, ...) to the current run.
+    """
+    documents = _documents.get()
+    if documents is not None:
+        documents.append(dict(document=document, **stats))
+
+
+@contextmanager
+def run(name, **labels):
+    """
+    Scopes one pipeline run. Its stage timers, counters and per-document stats are
+    collected on the side. When the run ends it appends one JSON line to METRICS_FILE
+    and refreshes the Prometheus text in PROMETHEUS_FILE. With PROFILE_DIR set, the
+    run is profiled with cProfile and written to <PROFILE_DIR>/<name>-<time>-<pid>.prof,
+    loadable with pstats or snakeviz. For sampling profilers such as py-spy, the stage
+    functions keep stable names, and nothing extra needs enabling.
+    """
+    metrics = Metrics()
+    sinks_token = _sinks.set(_sinks.get() + (metrics,))
+    documents_token = _documents.set([])
+    profiler = None
+    if PROFILE_DIR:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    started = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        seconds = time.perf_counter() - start
+        documents = _documents.get()
+        _documents.reset(documents_token)
+        _sinks.reset(sinks_token)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(
+                PROFILE_DIR, f"{name}-{started.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.prof"
+            ))
+        registry.observe(f"run.{name}", seconds)
+
+        record = {"event": "run", "name": name, "started": started.isoformat(), "seconds": round(seconds, 6)}
+        record.update(labels)
+        record.update(metrics.snapshot())
+        record["documents"] = documents
+        if METRICS_FILE:
+            emit(record)
+        if PROMETHEUS_FILE:
+            write_prometheus(PROMETHEUS_FILE)
+
+
+def instrumented(name):
+    """
+    Decorator running every call of the function as run(name).
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with run(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def emit(record, path=None):
+    """
+    Appends record as one JSON line to path (default METRICS_FILE).
+    """
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _write_lock:
+        with open(path or METRICS_FILE, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def _metric_name(name):
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus_text(metrics=registry):
+    """
+    Renders metrics in the Prometheus text exposition format: one seconds/calls pair
+    per stage (labelled by stage) and one total per counter.
+    """
+    snapshot = metrics.snapshot()
+    lines = [
+        f"# HELP {METRIC_PREFIX}_stage_seconds_total Time spent in each pipeline stage.",
+        f"# TYPE {METRIC_PREFIX}_stage_seconds_total counter"
+    ]
+    for stage, timer in sorted(snapshot["timers"].items()):
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_total{{stage="{stage}"}} {timer["seconds"]}')
+    lines += [
+        f"# HELP {METRIC_PREFIX}_stage_calls_total Calls of each pipeline stage.",
+        f"# TYPE {METRIC_PREFIX}_stage_calls_total counter"
+    ]
+    for stage, timer in sorted(snapshot["timers"].items()):
+        lines.append(f'{METRIC_PREFIX}_stage_calls_total{{stage="{stage}"}} {timer["count"]}')
+    for name, value in sorted(snapshot["counters"].items()):
+        metric = f"{METRIC_PREFIX}_{_metric_name(name)}_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path, metrics=registry):
+    """
+    Atomically rewrites path with prometheus_text(metrics), e.g. for node_exporter's textfile collector.
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text(metrics))
+    os.replace(tmp_path, path)
@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import re
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from utils import cos_sim
+from vector_index import BruteForceIndex, top_k_indices
+
+# Retrieval mode of find_relevant_sections: "semantic" (embeddings only), "filter" (BM25
+# picks the candidates, embeddings rank them) or "hybrid" (fused BM25 + embedding score)
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "semantic")
+# Lexical hits per query passed to the embedding scorer in "filter" mode
+FILTER_CANDIDATES = int(os.environ.get("FILTER_CANDIDATES", "50"))
+# Weight of the embedding similarity in "hybrid" mode; the rest goes to the normalized BM25 score
+HYBRID_ALPHA = float(os.environ.get("HYBRID_ALPHA", "0.7"))
+
+MODES = ("semantic", "filter", "hybrid")
+
+# Words, numbers and codes such as "10-k", "iso-27001" or "v2.1"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in into is it its of on or that the their this to was "
+    "were will with persona task".split()
+)
+
+
+def tokenize(text):
+    """
+    Lowercased terms of text. Compound codes are indexed both whole and by their
+    parts, so "ISO-27001" also matches a query for "ISO 27001".
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        parts = re.split(r"[.\-/]", token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part and part not in STOPWORDS)
+    return terms
+
+
+class BM25Index:
+    """
+    Okapi BM25 over an inverted index: each term maps to the ids of the texts
+    containing it and its frequency in each, so a query only touches the postings
+    of its own terms.
+    """
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        postings = defaultdict(lambda: defaultdict(int))
+        lengths = []
+        for doc_id, text in enumerate(texts):
+            terms = tokenize(text)
+            lengths.append(len(terms))
+            for term in terms:
+                postings[term][doc_id] += 1
+
+        self.doc_count = len(lengths)
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        avg_length = float(self.lengths.mean()) if self.doc_count else 0.0
+        # Per-document part of the BM25 denominator
+        self._norm = k1 * (1 - b + b * self.lengths / max(avg_length, 1e-9))
+        self.postings = {
+            term: (np.fromiter(docs.keys(), dtype=np.int64, count=len(docs)),
+                   np.fromiter(docs.values(), dtype=np.float32, count=len(docs)))
+            for term, docs in postings.items()
+        }
+
+    def __len__(self):
+        return self.doc_count
+
+    def idf(self, term):
+        df = len(self.postings[term][0]) if term in self.postings else 0
+        return float(np.log(1 + (self.doc_count - df + 0.5) / (df + 0.5)))
+
+    def scores(self, queries):
+        """
+        Returns the (len(queries) x texts) BM25 score matrix of query strings.
+        """
+        result = np.zeros((len(queries), self.doc_count), dtype=np.float32)
+        for q, query in enumerate(queries):
+            for term in set(tokenize(query)):
+                if term not in self.postings:
+                    continue
+                ids, tf = self.postings[term]
+                result[q, ids] += self.idf(term) * tf * (self.k1 + 1) / (tf + self._norm[ids])
+        return result
+
+    def search(self, queries, k):
+        """
+        Returns (scores, ids), both (len(queries), k), best first. Texts sharing no
+        term with a query are never returned; those slots hold score 0 and id -1.
+        """
+        scores = self.scores(queries)
+        ids = top_k_indices(scores, k)
+        top_scores = np.take_along_axis(scores, ids, axis=1)
+        ids[top_scores <= 0] = -1
+        return top_scores, ids
+
+
+def retrieve(query_texts, query_embeddings, chunks, encode_chunks, top_k=5, mode=RETRIEVAL_MODE,
+             candidates=FILTER_CANDIDATES, alpha=HYBRID_ALPHA, lexical=None):
+    """
+    Selects the top_k chunks for each query and returns their ids, one row per query
+    (best first, -1 padded).
+    - "semantic": embed every chunk and rank by cosine similarity.
+    - "filter": only the `candidates` best BM25 hits of each query are embedded and
+      ranked by cosine similarity. Queries with fewer than top_k lexical hits fall
+      back to all chunks.
+    - "hybrid": embed every chunk and rank by alpha * cosine + (1 - alpha) * BM25,
+      the BM25 scores scaled to [0, 1] per query.
+    encode_chunks maps a list of chunk contents to their embeddings; lexical is an
+    optional prebuilt BM25Index over the chunks.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {', '.join(MODES)}")
+    query_embeddings = np.atleast_2d(query_embeddings)
+    contents = [chunk["content"] for chunk in chunks]
+    if mode == "semantic":
+        _, ids = BruteForceIndex(encode_chunks(contents)).search(query_embeddings, top_k)
+        return ids
+
+    lexical = lexical if lexical is not None else BM25Index(contents)
+    if mode == "hybrid":
+        similarities = cos_sim(query_embeddings, encode_chunks(contents))
+        lexical_scores = lexical.scores(query_texts)
+        lexical_scores /= np.maximum(lexical_scores.max(axis=1, keepdims=True), 1e-9)
+        return top_k_indices(alpha * similarities + (1 - alpha) * lexical_scores, top_k)
+
+    _, hits = lexical.search(query_texts, max(candidates, top_k))
+    fallback = (hits >= 0).sum(axis=1) < top_k
+    if fallback.any():
+        selected = np.arange(len(chunks))
+    else:
+        selected = np.unique(hits[hits >= 0])
+    similarities = cos_sim(query_embeddings, encode_chunks([contents[i] for i in selected]))
+
+    # Each query only ranks its own candidates (or everything, when it fell back)
+    allowed = np.zeros((len(query_embeddings), len(chunks)), dtype=bool)
+    for q, row in enumerate(hits):
+        if fallback[q]:
+            allowed[q] = True
+        else:
+            allowed[q, row[row >= 0]] = True
+    similarities[~allowed[:, selected]] = -np.inf
+    top = top_k_indices(similarities, top_k)
+    ids = selected[top]
+    ids[np.isneginf(np.take_along_axis(similarities, top, axis=1))] = -1
+    return ids
+
+
+def compare_modes(pdf_paths, queries, top_k=5, modes=MODES, repeats=3):
+    """
+    Runs every retrieval mode over the same chunks and queries and reports, per mode,
+    its latency (best of repeats, chunk encoding included, embedding store disabled),
+    how many chunks it embedded, its top_k overlap with the semantic ranking, and how
+    often its top_k contains a chunk with a query's exact codes (terms holding a digit).
+    """
+    from parallel import extract_structures
+    from structure_cache import default_cache
+    from task_1b import build_chunks, build_query, encode_texts, load_model
+
+    chunks = []
+    for pdf_path, structure in zip(pdf_paths, extract_structures(pdf_paths, cache=default_cache())):
+        if "error" in structure:
+            print(f"Skipping file due to error: {structure['error']}")
+            continue
+        chunks.extend(build_chunks(structure, pdf_path))
+    if not chunks:
+        raise ValueError("Could not extract any content from the documents.")
+
+    model = load_model()
+    query_texts = [build_query(persona, job) for persona, job in queries]
+    query_embeddings = encode_texts(model, query_texts)
+    encode_texts(model, [chunks[0]["content"]])  # warm-up
+
+    chunk_terms = [set(tokenize(chunk["content"])) for chunk in chunks]
+    codes = [{t for t in tokenize(text) if any(c.isdigit() for c in t)} for text in query_texts]
+
+    report = {"chunks": len(chunks), "queries": len(queries), "top_k": top_k, "modes": {}}
+    rankings = {}
+    for mode in modes:
+        encoded = []
+
+        def encode_chunks(texts):
+            encoded.append(len(texts))
+            return encode_texts(model, texts)
+
+        best = float("inf")
+        for _ in range(repeats):
+            encoded.clear()
+            start = time.perf_counter()
+            ids = retrieve(query_texts, query_embeddings, chunks, encode_chunks, top_k=top_k, mode=mode)
+            best = min(best, time.perf_counter() - start)
+        rankings[mode] = ids
+
+        with_codes = [q for q in range(len(queries)) if codes[q]]
+        code_hits = sum(any(codes[q] & chunk_terms[i] for i in ids[q] if i >= 0) for q in with_codes)
+        report["modes"][mode] = {
+            "seconds": round(best, 4), "chunks_embedded": sum(encoded),
+            "exact_code_hit_rate": round(code_hits / len(with_codes), 4) if with_codes else None
+        }
+
+    if "semantic" in rankings:
+        for mode, ids in rankings.items():
+            overlaps = [
+                len(set(row[row >= 0].tolist()) & set(ref[ref >= 0].tolist())) / max((ref >= 0).sum(), 1)
+                for row, ref in zip(ids, rankings["semantic"])
+            ]
+            report["modes"][mode]["overlap_with_semantic"] = round(float(np.mean(overlaps)), 4)
+    return report
+
+
+if __name__ == '__main__':
+    from corpus_index import read_queries
+
+    parser = argparse.ArgumentParser(description="Compare semantic, BM25-filtered and hybrid retrieval on a local corpus.")
+    parser.add_argument("--pdfs", nargs="+", required=True)
+    parser.add_argument("--queries", required=True, help="JSONL of persona/job queries.")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--output", help="Also write the report to this JSON file.")
+    args = parser.parse_args()
+
+    report = compare_modes(args.pdfs, read_queries(args.queries), top_k=args.top_k)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
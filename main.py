@@ -1,43 +1,280 @@
 import os
+import sys
 import json
-from task_1a import extract_structure
+import glob
+import hashlib
+import threading
+
+from parallel import extract_structures, default_workers
+from structure_cache import default_cache, extractor_fingerprint, file_hash
+from encoder import embedding_model_id, resolve_backend
+from lexical_index import FILTER_CANDIDATES, HYBRID_ALPHA, RETRIEVAL_MODE, MODES
+from batching import TOKEN_BUDGET, WINDOW_OVERLAP
+from task_1b import REFINE_TOP_N, TOP_K, model_path
+from dedup import DEDUP, DEDUP_COLLAPSE, DEDUP_THRESHOLD
 
 # Define the input and output directories as specified in the hackathon brief
-INPUT_DIR = "/app/input"
-OUTPUT_DIR = "/app/output"
+INPUT_DIR = os.environ.get("INPUT_DIR", "/app/input")
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "/app/output")
+# Number of worker processes used to parse PDFs (PDF_WORKERS or the CPU count)
+MAX_WORKERS = default_workers()
+# Collections ranked at the same time; they share the loaded model and the MAX_WORKERS pool
+COLLECTION_WORKERS = max(1, int(os.environ.get("COLLECTION_WORKERS", "2")))
 
-def process_all_pdfs():
+CONFIG_FILE = "config.json"
+# Per-collection input file of the challenge layout: <collection>/challenge1b_input.json with a PDFs/ folder
+CHALLENGE_INPUT_FILE = "challenge1b_input.json"
+# Fingerprints of the collections last written successfully, kept next to the outputs
+STATE_FILE = ".runs.json"
+
+
+def write_json_atomic(path, data):
     """
-    Processes all PDF files from the input directory and saves their
-    structured outline to the output directory. This is the main function
-    for the Docker container execution.
+    Writes data as JSON to a temporary file next to path and renames it over path,
+    so readers never see a half-written output.
     """
-    print("Starting PDF processing...")
-    if not os.path.exists(INPUT_DIR):
-        print(f"Error: Input directory '{INPUT_DIR}' not found. Please mount it correctly.")
-        return
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, path)
 
-    # Ensure the output directory exists
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    pdf_files = [f for f in os.listdir(INPUT_DIR) if f.lower().endswith('.pdf')]
+def _text_field(value, key):
+    # The challenge format wraps persona and job as {"role": ...} and {"task": ...}
+    if isinstance(value, dict):
+        value = value.get(key)
+    return value.strip() if isinstance(value, str) else None
+
+
+def parse_collection(entry, input_dir, default_name, base_dir=None):
+    """
+    Normalizes one collection of the config into {name, persona, job_to_be_done,
+    pdf_paths, output, mode, priority, deadline}, or returns {"error": ...}. Accepts
+    plain strings or the challenge format (persona.role, job_to_be_done.task,
+    documents[].filename). Without a documents list, every PDF in the collection's
+    pdf_dir is used. deadline is in seconds from the start of the run.
+    """
+    name = entry.get("name") or entry.get("challenge_info", {}).get("challenge_id") or default_name
+    persona = _text_field(entry.get("persona"), "role")
+    job = _text_field(entry.get("job_to_be_done"), "task")
+    if not persona or not job:
+        return {"error": f"Collection '{name}' needs a persona and a job_to_be_done."}
+
+    mode = entry.get("mode", RETRIEVAL_MODE)
+    if mode not in MODES:
+        return {"error": f"Collection '{name}' has unknown mode '{mode}'; expected one of {', '.join(MODES)}."}
+
+    priority, deadline = entry.get("priority", 0), entry.get("deadline")
+    if not isinstance(priority, int) or not (deadline is None or isinstance(deadline, (int, float))):
+        return {"error": f"Collection '{name}' needs an integer priority and a deadline in seconds."}
+
+    pdf_dir = os.path.join(base_dir or input_dir, entry.get("pdf_dir", "."))
+    documents = entry.get("documents")
+    if documents is None:
+        filenames = sorted(f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')) if os.path.isdir(pdf_dir) else []
+    else:
+        filenames = [doc.get("filename") if isinstance(doc, dict) else doc for doc in documents]
+        if not all(isinstance(f, str) and f for f in filenames):
+            return {"error": f"Collection '{name}' has a document without a filename."}
+    if not filenames:
+        return {"error": f"Collection '{name}' has no documents."}
+
+    return {
+        "name": name,
+        "persona": persona,
+        "job_to_be_done": job,
+        "pdf_paths": [os.path.join(pdf_dir, f) for f in filenames],
+        "output": entry.get("output", f"{name}_output.json"),
+        "mode": mode,
+        "priority": priority,
+        "deadline": deadline
+    }
+
+
+def load_collections(input_dir):
+    """
+    Reads the collections to run from input_dir. A config.json holds either one
+    collection or {"collections": [...]}; a single collection without a name writes
+    challenge1b_output.json. Without config.json, every subdirectory holding a
+    challenge1b_input.json (and its PDFs/ folder) is a collection. Returns None
+    when neither exists.
+    """
+    config_path = os.path.join(input_dir, CONFIG_FILE)
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        if "collections" in config:
+            return [
+                parse_collection(entry, input_dir, f"collection_{i + 1}")
+                for i, entry in enumerate(config["collections"])
+            ]
+        collection = parse_collection(config, input_dir, "challenge1b")
+        if "error" not in collection and "output" not in config and "name" not in config:
+            collection["output"] = "challenge1b_output.json"
+        return [collection]
+
+    collections = []
+    for path in sorted(glob.glob(os.path.join(input_dir, "*", CHALLENGE_INPUT_FILE))):
+        base_dir = os.path.dirname(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        entry.setdefault("pdf_dir", "PDFs")
+        entry.setdefault("name", os.path.basename(base_dir))
+        collections.append(parse_collection(entry, input_dir, os.path.basename(base_dir), base_dir=base_dir))
+    return collections or None
+
+
+def pipeline_fingerprint():
+    """
+    Identifies everything besides the inputs that changes the results: the extractor,
+    the embedding model and backend, the encoding batches and windows, the retrieval,
+    refinement and deduplication settings.
+    """
+    try:
+        model_id = embedding_model_id(model_path, resolve_backend(model_path))
+    except Exception:
+        model_id = "unknown"
+    encoding = f"budget{TOKEN_BUDGET}:overlap{WINDOW_OVERLAP}"
+    retrieval = f"{RETRIEVAL_MODE}:k{TOP_K}:candidates{FILTER_CANDIDATES}:alpha{HYBRID_ALPHA}"
+    dedup = f"dedup{DEDUP_THRESHOLD}{'c' if DEDUP_COLLAPSE else ''}" if DEDUP else "nodedup"
+    return f"{extractor_fingerprint()}:{model_id}:{encoding}:{retrieval}:top{REFINE_TOP_N}:{dedup}"
+
+
+def collection_fingerprint(collection, pipeline):
+    """
+    Hashes a collection's settings, the content of its PDFs and the pipeline fingerprint.
+    """
+    digest = hashlib.sha256(pipeline.encode("utf-8"))
+    settings = {key: collection[key] for key in ("persona", "job_to_be_done", "mode", "output")}
+    digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    for path in collection["pdf_paths"]:
+        try:
+            content = file_hash(path)
+        except OSError:
+            content = "missing"
+        digest.update(f"\0{os.path.basename(path)}:{content}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_state(output_dir):
+    try:
+        with open(os.path.join(output_dir, STATE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_collection(collection, result):
+    """
+    Writes a collection's result atomically. Returns False if it failed or could not be saved.
+    """
+    name = collection["name"]
+    output_path = os.path.join(OUTPUT_DIR, collection["output"])
+    if "error" in result:
+        print(f"Collection '{name}' failed: {result['error']}")
+        return False
+    try:
+        write_json_atomic(output_path, result)
+    except OSError as e:
+        print(f"Error saving file to '{output_path}': {e}")
+        return False
+    print(f"Successfully saved output to '{output_path}'")
+    return True
+
+
+def process_collections(collections):
+    """
+    Submits the changed collections to a Scheduler (COLLECTION_WORKERS at a time,
+    by priority and deadline, sharing one model and one pool of MAX_WORKERS), and
+    records the fingerprint of each success so an unchanged collection is skipped
+    next time. Returns the number of collections that failed.
+    """
+    from scheduler import Scheduler
+
+    failed = 0
+    valid = []
+    for collection in collections:
+        if "error" in collection:
+            print(f"Error: {collection['error']}")
+            failed += 1
+        else:
+            valid.append(collection)
+
+    names = [c["name"] for c in valid]
+    outputs = [c["output"] for c in valid]
+    if len(set(names)) != len(names) or len(set(outputs)) != len(outputs):
+        print("Error: collection names and output files must be unique.")
+        return failed + len(valid)
+
+    state = load_state(OUTPUT_DIR)
+    pipeline = pipeline_fingerprint()
+    changed = []
+    for collection in valid:
+        fingerprint = collection_fingerprint(collection, pipeline)
+        output_path = os.path.join(OUTPUT_DIR, collection["output"])
+        if state.get(collection["name"]) == fingerprint and os.path.exists(output_path):
+            print(f"Skipping collection '{collection['name']}': unchanged since the last run.")
+        else:
+            changed.append((collection, fingerprint))
+    if not changed:
+        return failed
+
+    try:
+        scheduler = Scheduler(max_jobs=min(COLLECTION_WORKERS, len(changed)), workers=MAX_WORKERS)
+    except Exception as e:
+        print(f"Error: failed to load model from '{model_path}': {e}")
+        return failed + len(changed)
+
+    with scheduler:
+        jobs = []
+        for collection, fingerprint in changed:
+            print(f"Processing collection '{collection['name']}' ({len(collection['pdf_paths'])} document(s))...")
+            job = scheduler.submit(
+                collection["pdf_paths"], collection["persona"], collection["job_to_be_done"],
+                priority=collection["priority"], deadline=collection["deadline"],
+                mode=collection["mode"], name=collection["name"]
+            )
+            jobs.append((collection, fingerprint, job))
+
+        for collection, fingerprint, job in jobs:
+            if not save_collection(collection, job.result()):
+                failed += 1
+                continue
+            state[collection["name"]] = fingerprint
+            write_json_atomic(os.path.join(OUTPUT_DIR, STATE_FILE), state)
+
+        for latency in scheduler.stats()["jobs"]:
+            print(f"  {latency['name']}: {latency['status']}, queued {latency['queued_seconds']}s, "
+                  f"ran {latency['run_seconds']}s, waited {latency['encode_wait_seconds']}s for the encoder")
+    return failed
+
+
+def process_all_pdfs():
+    """
+    Processes all PDF files from the input directory and saves their
+    structured outline to the output directory. Used when the input
+    directory holds PDFs but no collection config.
+    """
+    pdf_files = sorted(f for f in os.listdir(INPUT_DIR) if f.lower().endswith('.pdf'))
     if not pdf_files:
         print(f"No PDF files found in '{INPUT_DIR}'.")
         return
 
-    print(f"Found {len(pdf_files)} PDF(s) to process: {pdf_files}")
+    print(f"Found {len(pdf_files)} PDF(s) to process with {MAX_WORKERS} worker(s): {pdf_files}")
+
+    # Extract all document structures in parallel; results come back in pdf_files order
+    input_paths = [os.path.join(INPUT_DIR, pdf_file) for pdf_file in pdf_files]
+    all_structures = extract_structures(input_paths, workers=MAX_WORKERS, cache=default_cache())
 
-    for pdf_file in pdf_files:
-        input_path = os.path.join(INPUT_DIR, pdf_file)
+    for pdf_file, input_path, structure_data in zip(pdf_files, input_paths, all_structures):
         # The output file should have the same name but with a .json extension
         output_filename = f"{os.path.splitext(pdf_file)[0]}.json"
         output_path = os.path.join(OUTPUT_DIR, output_filename)
-        
-        print(f"Processing '{input_path}'...")
-        
-        # Use our existing function to extract the document structure
-        structure_data = extract_structure(input_path)
-        
+
+        if "error" in structure_data:
+            print(f"Skipping '{input_path}': {structure_data['error']}")
+            continue
+
         # Remove the temporary 'bbox' and 'raw_blocks' keys before final output
         clean_outline = []
         for item in structure_data.get("outline", []):
@@ -49,15 +286,45 @@ def process_all_pdfs():
             "title": structure_data.get("title", "Title not found"),
             "outline": clean_outline
         }
-        
+
         # Save the output to the specified directory
         try:
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(output_json, f, indent=4, ensure_ascii=False)
+            write_json_atomic(output_path, output_json)
             print(f"Successfully saved output to '{output_path}'")
         except Exception as e:
             print(f"Error saving file to '{output_path}': {e}")
 
-if __name__ == '__main__':
-    process_all_pdfs()
 
+def main():
+    """
+    Entry point of the Docker container: runs the persona-driven analysis for every
+    collection configured in the input directory, or writes per-PDF outlines when
+    there is no config. Exits with status 1 if any collection failed.
+    """
+    print("Starting batch run...")
+    if not os.path.exists(INPUT_DIR):
+        print(f"Error: Input directory '{INPUT_DIR}' not found. Please mount it correctly.")
+        sys.exit(1)
+
+    # Ensure the output directory exists
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    try:
+        collections = load_collections(INPUT_DIR)
+    except (OSError, ValueError) as e:
+        print(f"Error: could not read the collection config: {e}")
+        sys.exit(1)
+
+    if collections is None:
+        print(f"No {CONFIG_FILE} found in '{INPUT_DIR}'; writing document outlines instead.")
+        process_all_pdfs()
+        return
+
+    failed = process_collections(collections)
+    print(f"Finished {len(collections)} collection(s), {failed} failed.")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import http.client
+import json
+import os
+import socket
+from urllib.parse import urlparse
+
+# Where the model server listens: "http://host:port" or "unix:///path/to/socket"
+SERVER_URL = os.environ.get("MODEL_SERVER_URL", "http://127.0.0.1:8765")
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ModelClient:
+    """
+    Minimal client for model_server. It uses only the standard library, so talking
+    to a warm server costs no torch or sentence-transformers import.
+    """
+
+    def __init__(self, url: str = SERVER_URL, timeout: float = 600.0):
+        self.url = url
+        self.timeout = timeout
+
+    def _connection(self, timeout):
+        parsed = urlparse(self.url)
+        if parsed.scheme == "unix":
+            return _UnixHTTPConnection(parsed.path, timeout)
+        return http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=timeout)
+
+    def _request(self, method, path, payload=None, timeout=None):
+        conn = self._connection(self.timeout if timeout is None else timeout)
+        try:
+            body = json.dumps(payload).encode("utf-8") if payload is not None else None
+            conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            data = json.loads(response.read().decode("utf-8"))
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise RuntimeError(data.get("error", f"Model server returned HTTP {response.status}"))
+        return data
+
+    def available(self) -> bool:
+        """
+        True when a server answers the health check at self.url.
+        """
+        try:
+            return self._request("GET", "/health", timeout=0.5).get("status") == "ok"
+        except (OSError, ValueError, RuntimeError):
+            return False
+
+    def encode(self, texts: list) -> list:
+        """
+        Returns the normalized embeddings of texts as lists of floats.
+        """
+        return self._request("POST", "/encode", {"texts": list(texts)})["embeddings"]
+
+    def find_relevant_sections(self, pdf_paths: list, persona: str, job_to_be_done: str) -> dict:
+        """
+        Runs find_relevant_sections on the server. Paths are made absolute because
+        the server may run from a different working directory.
+        """
+        payload = {
+            "pdf_paths": [os.path.abspath(p) for p in pdf_paths],
+            "persona": persona, "job_to_be_done": job_to_be_done
+        }
+        return self._request("POST", "/rank", payload)
+
+    def find_relevant_sections_batch(self, pdf_paths: list, queries: list) -> list:
+        payload = {
+            "pdf_paths": [os.path.abspath(p) for p in pdf_paths],
+            "queries": [{"persona": persona, "job_to_be_done": job} for persona, job in queries]
+        }
+        return self._request("POST", "/rank_batch", payload)["results"]
@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import urlparse
+
+from model_client import SERVER_URL
+from parallel import default_workers, new_pool, replace_broken
+from task_1b import encode_texts, find_relevant_sections, find_relevant_sections_batch, load_model, model_path
+
+# Largest request body accepted, in bytes
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+
+class RankingHandler(BaseHTTPRequestHandler):
+    """
+    JSON over HTTP:
+      GET  /health      -> {"status": "ok", "model_path": ...}
+      POST /encode      {"texts": [...]} -> {"embeddings": [[...], ...]}
+      POST /rank        {"pdf_paths", "persona", "job_to_be_done"} -> find_relevant_sections output
+      POST /rank_batch  {"pdf_paths", "queries": [{"persona", "job_to_be_done"}, ...]} -> {"results": [...]}
+    Each request runs on its own thread; PDF parsing overlaps freely while encode calls share the one warm model.
+    """
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "model_path": model_path})
+        else:
+            self._send_json(404, {"error": f"Unknown endpoint '{self.path}'"})
+
+    def do_POST(self):
+        routes = {"/encode": self._encode, "/rank": self._rank, "/rank_batch": self._rank_batch}
+        route = routes.get(self.path)
+        if route is None:
+            self._send_json(404, {"error": f"Unknown endpoint '{self.path}'"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length > MAX_REQUEST_BYTES:
+                self._send_json(413, {"error": "Request body too large"})
+                return
+            payload = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+        except ValueError as e:
+            self._send_json(400, {"error": f"Invalid JSON body: {e}"})
+            return
+
+        try:
+            status, result = route(payload)
+        except KeyError as e:
+            status, result = 400, {"error": f"Missing field {e}"}
+        except Exception as e:
+            status, result = 500, {"error": f"{type(e).__name__}: {e}"}
+        self._send_json(status, result)
+
+    def _encode(self, payload):
+        embeddings = encode_texts(load_model(), list(payload["texts"]))
+        return 200, {"embeddings": embeddings.tolist()}
+
+    def _rank(self, payload):
+        result = find_relevant_sections(
+            payload["pdf_paths"], payload["persona"], payload["job_to_be_done"], executor=self._pool()
+        )
+        return 200, result
+
+    def _rank_batch(self, payload):
+        queries = [(q["persona"], q["job_to_be_done"]) for q in payload["queries"]]
+        return 200, {"results": find_relevant_sections_batch(payload["pdf_paths"], queries, executor=self._pool())}
+
+    def _pool(self):
+        # A worker crash breaks the whole pool: replace it for this and later requests
+        server = self.server
+        if server.pool is None:
+            return None
+        with server.pool_lock:
+            server.pool = replace_broken(server.pool, default_workers())
+            return server.pool
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) address
+        return self.client_address[0] if self.client_address else "unix"
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+        self.server_name, self.server_port = "localhost", 0
+
+
+def create_server(url: str = SERVER_URL, pool=None):
+    """
+    Creates (but does not start) a threaded server bound to an http:// or unix:// URL.
+    Ranking requests parse PDFs on pool, a long-lived extraction pool shared by all
+    requests; without one, each request creates its own.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        server = ThreadingUnixHTTPServer(parsed.path, RankingHandler)
+    else:
+        server = ThreadingHTTPServer((parsed.hostname or "127.0.0.1", parsed.port or 8765), RankingHandler)
+    server.pool = pool
+    server.pool_lock = threading.Lock()
+    return server
+
+
+def serve(url: str = SERVER_URL):
+    """
+    Starts the extraction pool, loads the model once, warms it up with a first encode
+    and serves requests until interrupted.
+    """
+    pool = new_pool(default_workers(), "spawn")
+    print(f"Loading model from '{model_path}'...")
+    encode_texts(load_model(), ["warm-up"])
+    server = create_server(url, pool)
+    print(f"Model server listening on {url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.shutdown()
+        parsed = urlparse(url)
+        if parsed.scheme == "unix" and os.path.exists(parsed.path):
+            os.remove(parsed.path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Keep the embedding model warm and serve ranking requests.")
+    parser.add_argument("--url", default=SERVER_URL, help="http://host:port or unix:///path/to/socket (default: MODEL_SERVER_URL).")
+    args = parser.parse_args()
+    serve(args.url)
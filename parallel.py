@@ -0,0 +1,247 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from instrumentation import capture, count, merge
+from structure_extractor import extract_structure, parse_pages, build_structure
+
+# Shards per worker in page-sharded mode; a few small shards balance uneven pages better than one big one
+SHARDS_PER_WORKER = 4
+# PDFs with at least this many pages are split by page range across the pool; 0 disables sharding
+SHARD_MIN_PAGES = int(os.environ.get("SHARD_MIN_PAGES", "200"))
+
+
+def default_workers():
+    """
+    Returns the worker count from the PDF_WORKERS environment variable, or the number of CPUs.
+    """
+    value = os.environ.get("PDF_WORKERS")
+    if value:
+        return max(1, int(value))
+    return os.cpu_count() or 1
+
+
+def new_pool(workers, start_method=None):
+    """
+    Creates a process pool for extraction. The per-call pools of one-off runs use the
+    platform's default start method. Long-lived pools shared by servers, the
+    scheduler or an event loop pass start_method="spawn": forking a process that
+    already runs threads or has torch loaded can deadlock the child. Spawned workers
+    only import the extractor, not the model.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method))
+
+
+def replace_broken(executor, workers):
+    """
+    Returns executor, or a fresh pool of workers processes if a worker crash broke it.
+    """
+    if getattr(executor, "_broken", False):
+        executor.shutdown(wait=False)
+        return new_pool(workers, "spawn")
+    return executor
+
+
+def _extract_worker(pdf_path):
+    """
+    Runs inside a pool worker. Only the plain structure dict travels back to the
+    parent, never a PyMuPDF object, and any exception becomes an error entry.
+    """
+    try:
+        return extract_structure(pdf_path)
+    except Exception as e:
+        return {"error": f"Could not open or process PDF {pdf_path}: {e}"}
+
+
+def _run_pool(pdf_paths, workers, executor=None, start_method=None):
+    """
+    Maps the worker over pdf_paths, in a new pool or on a shared executor.
+    Paths whose worker died with the pool are returned separately.
+    """
+    if executor is None:
+        with new_pool(workers, start_method) as executor:
+            return _run_pool(pdf_paths, workers, executor)
+
+    results = {}
+    crashed = []
+    futures = {}
+    for path in pdf_paths:
+        try:
+            # Workers return their stage timings along with the structure
+            futures[path] = executor.submit(capture, _extract_worker, path)
+        except BrokenProcessPool:
+            crashed.append(path)  # A shared pool broken by an earlier crash
+    for path, future in futures.items():
+        try:
+            results[path], snapshot = future.result()
+            merge(snapshot)
+        except BrokenProcessPool:
+            crashed.append(path)
+        except Exception as e:
+            results[path] = {"error": f"Could not open or process PDF {path}: {e}"}
+    return results, crashed
+
+
+def _cache_lookup(cache, pdf_paths):
+    """
+    Splits pdf_paths into cache hits and the keys of the misses that still need parsing.
+    """
+    hits, keys = {}, {}
+    if cache is None:
+        return hits, keys
+    for path in pdf_paths:
+        try:
+            key = cache.key_for(path)
+        except OSError:
+            continue  # Unreadable file: let the extractor report it
+        structure = cache.get(key)
+        if structure is None:
+            keys[path] = key
+        else:
+            hits[path] = structure
+    return hits, keys
+
+
+def _page_count(pdf_path):
+    import fitz  # PyMuPDF
+
+    try:
+        with fitz.open(pdf_path) as doc:
+            return doc.page_count
+    except Exception:
+        return 0  # Let the extractor report it
+
+
+def extract_structures(pdf_paths: list, workers: int = None, cache=None, executor=None,
+                       shard_min_pages: int = SHARD_MIN_PAGES) -> list:
+    """
+    Extracts the structure of every PDF in pdf_paths using a process pool.
+    Results are returned in the same order as pdf_paths; a PDF that fails, or
+    even crashes its worker, yields an {"error": ...} entry instead of stopping the batch.
+    With a StructureCache, unchanged PDFs are served from disk without being parsed.
+    With an executor (a ProcessPoolExecutor shared by several callers), the PDFs are
+    submitted to it instead of a pool of their own, and workers is ignored.
+    PDFs of at least shard_min_pages pages are split by page range across the pool
+    (see extract_structure_sharded) instead of going to a single worker.
+    """
+    pdf_paths = list(pdf_paths)
+    hits, keys = _cache_lookup(cache, pdf_paths)
+    count("structure_cache.hits", len(hits))
+    pending = [path for path in dict.fromkeys(pdf_paths) if path not in hits]
+
+    if workers is None:
+        workers = default_workers()
+    results = {}
+    if shard_min_pages > 0 and (workers > 1 or executor is not None):
+        for path in [path for path in pending if _page_count(path) >= shard_min_pages]:
+            results[path] = _extract_sharded(path, workers, executor)
+            count("extract.sharded_documents")
+            pending.remove(path)
+    workers = min(workers, len(pending))
+
+    if not pending:
+        crashed = []
+    elif executor is not None:
+        pooled, crashed = _run_pool(pending, workers, executor)
+        results.update(pooled)
+    elif workers <= 1:
+        results.update({path: _extract_worker(path) for path in pending})
+        crashed = []
+    else:
+        pooled, crashed = _run_pool(pending, workers)
+        results.update(pooled)
+
+    # A hard crash (e.g. a segfault on a corrupt file) breaks the whole pool and
+    # every document still in flight with it. Retry those one at a time in a
+    # fresh single-worker pool so only the real culprit is reported. Callers sharing an
+    # executor run other threads, so their retry pools are spawned too.
+    for path in crashed:
+        retry, still_crashed = _run_pool([path], 1, start_method="spawn" if executor is not None else None)
+        if still_crashed:
+            results[path] = {"error": f"Worker crashed while processing PDF {path}"}
+        else:
+            results[path] = retry[path]
+
+    # A failed cache write (full disk, read-only directory) must not lose the results
+    try:
+        for path, key in keys.items():
+            cache.put(key, results[path])
+    except OSError as e:
+        print(f"Could not write to the structure cache: {e}")
+    results.update(hits)
+
+    return [results[path] for path in pdf_paths]
+
+
+def _parse_shard_worker(pdf_path, start, stop):
+    """
+    Runs inside a pool worker: opens its own handle on the PDF and parses pages [start, stop).
+    """
+    import fitz  # PyMuPDF
+
+    doc = fitz.open(pdf_path)
+    try:
+        return parse_pages(doc, start, stop)
+    finally:
+        doc.close()
+
+
+def page_ranges(page_count, shard_count):
+    """
+    Splits range(page_count) into at most shard_count contiguous, near-equal (start, stop) ranges.
+    """
+    shard_count = max(1, min(shard_count, page_count))
+    size, extra = divmod(page_count, shard_count)
+    ranges = []
+    start = 0
+    for i in range(shard_count):
+        stop = start + size + (1 if i < extra else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def extract_structure_sharded(pdf_path: str, workers: int = None, cache=None) -> dict:
+    """
+    Extracts the structure of one large PDF by splitting its page range across a process pool.
+    Each worker returns a partial font histogram, heading candidates and raw blocks for its
+    pages; the parent merges the histograms in page order and runs the global scoring and
+    classify_headings pass, so the result is identical to extract_structure.
+    extract_structures does this for every PDF of at least SHARD_MIN_PAGES pages.
+    """
+    return extract_structures([pdf_path], workers, cache, shard_min_pages=1)[0]
+
+
+def _extract_sharded(pdf_path, workers, executor=None):
+    import fitz  # PyMuPDF
+
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception as e:
+        return {"error": f"Could not open or process PDF {pdf_path}: {e}"}
+    page_count = doc.page_count
+    metadata = doc.metadata or {}
+    doc.close()
+
+    if workers is None:
+        workers = default_workers()
+    if (workers <= 1 and executor is None) or page_count <= 1:
+        return _extract_worker(pdf_path)
+    if executor is None:
+        ranges = page_ranges(page_count, workers * SHARDS_PER_WORKER)
+        with new_pool(min(workers, len(ranges))) as executor:
+            return _extract_sharded(pdf_path, workers, executor)
+
+    ranges = page_ranges(page_count, max(workers, 1) * SHARDS_PER_WORKER)
+    try:
+        futures = [executor.submit(capture, _parse_shard_worker, pdf_path, start, stop) for start, stop in ranges]
+        shards = []
+        for future in futures:
+            shard, snapshot = future.result()
+            merge(snapshot)
+            shards.append(shard)
+    except Exception as e:
+        return {"error": f"Could not open or process PDF {pdf_path}: {e}"}
+
+    return build_structure(shards, metadata)
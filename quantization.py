@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from batching import encode_budgeted
+from corpus_index import read_queries
+from encoder import ONNX_FILE, ONNX_INT8_FILE, export_onnx, get_encoder
+from parallel import extract_structures
+from structure_cache import default_cache
+from task_1b import build_chunks, build_query, model_path
+from utils import cos_sim, create_sample_pdfs
+from vector_index import top_k_indices
+
+DEFAULT_QUERIES = [
+    ("An investment analyst with expertise in the tech sector.", "Analyze revenue trends and R&D investments to understand market positioning."),
+    ("A PhD researcher in computational biology.", "Prepare a literature review on graph neural networks for drug discovery."),
+]
+
+
+def quantize_onnx(model_path: str = model_path) -> str:
+    """
+    Writes model_int8.onnx next to the saved model: the exported graph with its weights
+    dynamically quantized to int8 (activations are quantized on the fly at inference).
+    Exports model.onnx first if it is missing, which needs torch.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    source = os.path.join(model_path, ONNX_FILE)
+    if not os.path.exists(source):
+        export_onnx(model_path, source)
+    target = os.path.join(model_path, ONNX_INT8_FILE)
+    quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+    return target
+
+
+def _time_encode(encoder, texts, repeats):
+    # Encodes the way ranking does: token-budgeted batches, long texts pooled over windows
+    encode_budgeted(encoder, texts[:8])  # warm-up: first calls pay for graph/allocator setup
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        embeddings = encode_budgeted(encoder, texts)[0]
+        best = min(best, time.perf_counter() - start)
+    return embeddings, best
+
+
+def evaluate_quantization(pdf_paths: list, queries: list, reference: str = "onnx", candidate: str = "onnx-int8",
+                          top_k: int = 5, repeats: int = 3) -> dict:
+    """
+    Encodes the chunks of a reference corpus with both backends, through the same
+    batching.encode_budgeted path as ranking, and reports encode throughput and how
+    much the top_k extracted_sections ranking moves between them.
+    """
+    chunks = []
+    for pdf_path, structure in zip(pdf_paths, extract_structures(pdf_paths, cache=default_cache())):
+        if "error" in structure:
+            print(f"Skipping file due to error: {structure['error']}")
+            continue
+        chunks.extend(build_chunks(structure, pdf_path))
+    if not chunks:
+        raise ValueError("Could not extract any content from the reference corpus.")
+    contents = [chunk["content"] for chunk in chunks]
+    query_texts = [build_query(persona, job) for persona, job in queries]
+
+    report = {"chunks": len(chunks), "queries": len(queries), "top_k": top_k, "backends": {}}
+    rankings = {}
+    embeddings = {}
+    for backend in (reference, candidate):
+        encoder = get_encoder(model_path, backend)
+        embeddings[backend], seconds = _time_encode(encoder, contents, repeats)
+        rankings[backend] = top_k_indices(cos_sim(encode_budgeted(encoder, query_texts)[0], embeddings[backend]), top_k)
+        report["backends"][backend] = {"encode_seconds": round(seconds, 4), "chunks_per_second": round(len(contents) / seconds, 2)}
+
+    overlaps, identical, rank_shifts = [], 0, []
+    for ref_row, cand_row in zip(rankings[reference].tolist(), rankings[candidate].tolist()):
+        shared = set(ref_row) & set(cand_row)
+        overlaps.append(len(shared) / max(len(ref_row), 1))
+        identical += ref_row == cand_row
+        rank_shifts.extend(abs(ref_row.index(c) - cand_row.index(c)) for c in shared)
+
+    agreement = (embeddings[reference] * embeddings[candidate]).sum(axis=1)
+    report["speedup"] = round(
+        report["backends"][reference]["encode_seconds"] / report["backends"][candidate]["encode_seconds"], 3
+    )
+    report["ranking"] = {
+        "mean_overlap_at_k": round(float(np.mean(overlaps)), 4),
+        "identical_top_k_fraction": round(identical / len(queries), 4),
+        "mean_rank_shift": round(float(np.mean(rank_shifts)), 4) if rank_shifts else 0.0
+    }
+    report["embedding_cosine"] = {"mean": round(float(agreement.mean()), 6), "min": round(float(agreement.min()), 6)}
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the int8 model variant and measure its speed/accuracy trade-off.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("quantize", help="Write model_int8.onnx (exports model.onnx first if needed).")
+    eval_parser = subparsers.add_parser("evaluate", help="Compare int8 against fp32 on a reference corpus.")
+    eval_parser.add_argument("--pdfs", nargs="+", help="Reference corpus (default: the generated sample PDFs).")
+    eval_parser.add_argument("--queries", help="JSONL of persona/job queries (default: two built-in queries).")
+    eval_parser.add_argument("--reference", default="onnx", help="fp32 backend to compare against.")
+    eval_parser.add_argument("--candidate", default="onnx-int8", help="Quantized backend under test.")
+    eval_parser.add_argument("--top-k", type=int, default=5)
+    eval_parser.add_argument("--output", help="Also write the report to this JSON file.")
+    args = parser.parse_args()
+
+    if args.command == "quantize":
+        print(f"Wrote quantized model to '{quantize_onnx()}'")
+    elif args.command == "evaluate":
+        pdfs = args.pdfs
+        if not pdfs:
+            create_sample_pdfs()
+            pdfs = ["gnn_report.pdf", "business_report.pdf"]
+        queries = read_queries(args.queries) if args.queries else DEFAULT_QUERIES
+        report = evaluate_quantization(pdfs, queries, args.reference, args.candidate, top_k=args.top_k)
+        print(json.dumps(report, indent=2))
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=4)
@@ -0,0 +1,322 @@
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from instrumentation import count, run, timer
+from lexical_index import RETRIEVAL_MODE
+from parallel import default_workers, extract_structures, new_pool, replace_broken
+from structure_cache import default_cache
+from task_1b import encode_texts, load_model, rank_documents
+
+# Collection jobs ranked at the same time; the rest wait in the priority queue
+SCHEDULER_JOBS = int(os.environ.get("SCHEDULER_JOBS", "2"))
+# Most texts per shared encode call; requests are split into pieces of this size so jobs interleave
+SCHEDULER_BATCH_TEXTS = int(os.environ.get("SCHEDULER_BATCH_TEXTS", "128"))
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Job:
+    """
+    One collection submitted to the Scheduler. result() blocks until it finishes and
+    returns the find_relevant_sections output, or an {"error": ...} dict.
+    """
+
+    def __init__(self, name, pdf_paths, persona, job_to_be_done, priority, deadline, mode, seq):
+        self.name = name
+        self.pdf_paths = list(pdf_paths)
+        self.persona = persona
+        self.job_to_be_done = job_to_be_done
+        self.priority = priority
+        self.deadline = deadline  # time.monotonic() value, or None
+        self.mode = mode
+        self.seq = seq
+        self.status = "queued"
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.encode_wait = 0.0
+        self.encoded_texts = 0
+        self._result = None
+        self._done = threading.Event()
+
+    def sort_key(self):
+        # Higher priority first, then earliest deadline, then submission order
+        return (-self.priority, self.deadline if self.deadline is not None else math.inf, self.seq)
+
+    def remaining(self):
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def check_deadline(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise DeadlineExceeded(f"Job '{self.name}' missed its deadline.")
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Job '{self.name}' is still {self.status}.")
+        return self._result
+
+    def latency(self):
+        """
+        Seconds spent queued, running and waiting for the shared encoder, plus the texts encoded.
+        """
+        now = time.monotonic()
+        started = self.started or now
+        return {
+            "name": self.name, "status": self.status, "priority": self.priority,
+            "queued_seconds": round(started - self.submitted, 4),
+            "run_seconds": round((self.finished or now) - started, 4) if self.started else 0.0,
+            "encode_wait_seconds": round(self.encode_wait, 4),
+            "encoded_texts": self.encoded_texts
+        }
+
+
+class _EncodeRequest:
+    def __init__(self, job, texts):
+        self.job = job
+        self.texts = texts
+        self.vectors = None
+        self.remaining = 0
+        self.cancelled = False
+        self.future = Future()
+
+
+class Scheduler:
+    """
+    Runs many collection jobs on one box with a single loaded model and one shared
+    extraction process pool. Up to max_jobs jobs run at once, picked from a queue by
+    priority, then earliest deadline. Their encode requests are split into pieces
+    of at most batch_texts texts, and one encoder thread fills each forward call
+    from the pending pieces of all jobs. It picks the same way (priority, deadline),
+    and between equals it picks the job that has had the fewest texts encoded, so
+    jobs share the encoder fairly and it never idles while any job has work.
+    A job past its deadline fails at its next wait with an {"error": ...} result.
+    """
+
+    def __init__(self, max_jobs=SCHEDULER_JOBS, workers=None, batch_texts=SCHEDULER_BATCH_TEXTS):
+        self.max_jobs = max(1, max_jobs)
+        self.workers = workers or default_workers()
+        self.batch_texts = max(1, batch_texts)
+        # Spawned workers, created before the model and the threads: never fork a process running torch or threads
+        self._executor = new_pool(self.workers, "spawn")
+        self.model = load_model()
+        self._executor_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._queue = []               # heap of (sort key, seq, job) waiting to start
+        self._pieces = {}              # job -> deque of (request, start, stop) waiting to be encoded
+        self._served = {}              # job -> texts encoded so far
+        self._jobs = []
+        self._running = 0
+        self._closed = False
+        self._seq = itertools.count()
+        self._threads = [threading.Thread(target=self._encode_loop, name="scheduler-encoder", daemon=True)]
+        self._threads += [
+            threading.Thread(target=self._job_loop, name=f"scheduler-job-{i}", daemon=True)
+            for i in range(self.max_jobs)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, pdf_paths, persona, job_to_be_done, priority=0, deadline=None, mode=RETRIEVAL_MODE, name=None):
+        """
+        Queues a collection and returns its Job. A higher priority runs first; deadline
+        is in seconds from now.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Scheduler is closed.")
+            seq = next(self._seq)
+            job = Job(
+                name or f"job-{seq}", pdf_paths, persona, job_to_be_done, priority,
+                None if deadline is None else time.monotonic() + deadline, mode, seq
+            )
+            self._jobs.append(job)
+            heapq.heappush(self._queue, (job.sort_key(), job.seq, job))
+            self._cond.notify_all()
+        count("scheduler.jobs_submitted")
+        return job
+
+    def stats(self):
+        """
+        Queue depths (jobs waiting to start, jobs running, texts waiting for the encoder)
+        and the latency of every job submitted so far.
+        """
+        with self._cond:
+            return {
+                "queued_jobs": len(self._queue),
+                "running_jobs": self._running,
+                "pending_encode_texts": sum(
+                    stop - start for pieces in self._pieces.values() for _, start, stop in pieces
+                ),
+                "jobs": [job.latency() for job in self._jobs]
+            }
+
+    def close(self, wait=True):
+        """
+        Stops accepting jobs; with wait, lets the queued ones finish first.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._executor.shutdown(wait=wait)
+
+    # --- Jobs ---
+
+    def _job_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                _, _, job = heapq.heappop(self._queue)
+                self._running += 1
+            try:
+                self._run_job(job)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._cond.notify_all()
+
+    def _run_job(self, job):
+        job.started = time.monotonic()
+        job.status = "running"
+        try:
+            job.check_deadline()
+            with run("scheduler_job", collection=job.name, priority=job.priority):
+                result = rank_documents(
+                    job.pdf_paths, job.persona, job.job_to_be_done, self.model,
+                    lambda texts: self._encode(job, texts), lambda paths: self._extract(job, paths), job.mode
+                )
+            job.status = "failed" if "error" in result else "done"
+        except DeadlineExceeded as e:
+            result = {"error": str(e)}
+            job.status = "expired"
+            count("scheduler.deadlines_missed")
+        except Exception as e:
+            result = {"error": f"Job '{job.name}' failed: {e}"}
+            job.status = "failed"
+        job.finished = time.monotonic()
+        job._result = result
+        job._done.set()
+        count(f"scheduler.jobs_{job.status}")
+
+    def _extract(self, job, pdf_paths):
+        with self._executor_lock:
+            # A worker crash breaks the whole pool: replace it for later jobs
+            self._executor = replace_broken(self._executor, self.workers)
+            executor = self._executor
+        structures = extract_structures(pdf_paths, cache=default_cache(), executor=executor)
+        job.check_deadline()
+        return structures
+
+    # --- Shared encoder ---
+
+    def _encode(self, job, texts):
+        """
+        Encodes texts for job through the shared encoder thread and waits for the result.
+        """
+        texts = list(texts)
+        if not texts:
+            return encode_texts(self.model, texts)
+        request = _EncodeRequest(job, texts)
+        pieces = [
+            (request, start, min(start + self.batch_texts, len(texts)))
+            for start in range(0, len(texts), self.batch_texts)
+        ]
+        request.remaining = len(pieces)
+        with self._cond:
+            self._pieces.setdefault(job, deque()).extend(pieces)
+            self._served.setdefault(job, 0)
+            self._cond.notify_all()
+
+        start = time.monotonic()
+        try:
+            remaining = job.remaining()
+            return request.future.result(timeout=None if remaining is None else max(remaining, 0))
+        except FutureTimeoutError:
+            request.cancelled = True
+            raise DeadlineExceeded(f"Job '{job.name}' missed its deadline.")
+        finally:
+            job.encode_wait += time.monotonic() - start
+
+    def _next_pieces(self):
+        """
+        Takes up to batch_texts texts of pending pieces, best job first. Called with the lock held.
+        """
+        taken = []
+        size = 0
+        while size < self.batch_texts:
+            ready = [job for job, pieces in self._pieces.items() if pieces]
+            if not ready:
+                break
+            job = min(ready, key=lambda j: (-j.priority, j.deadline if j.deadline is not None else math.inf,
+                                            self._served[j], j.seq))
+            request, start, stop = self._pieces[job].popleft()
+            if request.cancelled:
+                continue
+            if taken and size + stop - start > self.batch_texts:
+                self._pieces[job].appendleft((request, start, stop))
+                break
+            taken.append((request, start, stop))
+            size += stop - start
+            self._served[job] += stop - start
+        return taken
+
+    def _encode_loop(self):
+        while True:
+            with self._cond:
+                while not any(self._pieces.values()) and not (self._closed and self._running == 0 and not self._queue):
+                    self._cond.wait()
+                taken = self._next_pieces()
+                if not taken:
+                    if self._closed and self._running == 0 and not self._queue:
+                        return
+                    continue
+                for job in [job for job, pieces in self._pieces.items() if not pieces]:
+                    del self._pieces[job]
+
+            texts = [text for request, start, stop in taken for text in request.texts[start:stop]]
+            try:
+                with timer("scheduler.encode_batch"):
+                    vectors = encode_texts(self.model, texts)
+            except Exception as e:
+                for request, _, _ in taken:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+            count("scheduler.encode_batches")
+            count("scheduler.encode_jobs_mixed", int(len({id(request.job) for request, _, _ in taken}) > 1))
+
+            offset = 0
+            for request, start, stop in taken:
+                if request.vectors is None:
+                    request.vectors = np.zeros((len(request.texts), vectors.shape[1]), dtype=np.float32)
+                request.vectors[start:stop] = vectors[offset:offset + stop - start]
+                offset += stop - start
+                request.job.encoded_texts += stop - start
+                request.remaining -= 1
+                if request.remaining == 0 and not request.future.done():
+                    request.future.set_result(request.vectors)
@@ -0,0 +1,191 @@
+import os
+import re
+
+import numpy as np
+
+# Nesting depth of each outline level; the document title is the root
+LEVEL_DEPTH = {"Title": 0, "H1": 1, "H2": 2, "H3": 3}
+
+
+def level_depth(level):
+    """
+    The nesting depth of an outline level: Title is 0 and "H<n>" is n, for any n.
+    """
+    if level in LEVEL_DEPTH:
+        return LEVEL_DEPTH[level]
+    if level.startswith("H") and level[1:].isdigit():
+        return int(level[1:])
+    return len(LEVEL_DEPTH)
+
+# Sentence-final punctuation (plus closing quotes/brackets) followed by whitespace and a sentence start
+SENTENCE_BOUNDARY = re.compile(r"[.!?][\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+# Words whose trailing period does not end a sentence
+ABBREVIATIONS = frozenset(
+    "al approx co corp dept dr e.g eq etc fig figs i.e inc jr ltd mr mrs ms no nos p pp prof sec sr st vol vs".split()
+)
+
+
+def section_headings(title, outline, page_count):
+    """
+    Orders the title (a pseudo-heading at the top of page 1) and the outline headings
+    by position, drops those on missing pages, and links each heading to its parent:
+    the closest preceding heading of a shallower level.
+    """
+    headings = [{"level": "Title", "text": title, "page": 1, "bbox": (0, 0, 0, 90)}] + list(outline)
+    headings = sorted(
+        (h for h in headings if h["page"] - 1 < page_count),
+        key=lambda h: (h["page"], h["bbox"][1])
+    )
+
+    sections = []
+    stack = []
+    for i, heading in enumerate(headings):
+        depth = level_depth(heading["level"])
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        sections.append({
+            "id": i, "title": heading["text"], "level": heading["level"],
+            "page": heading["page"], "end_page": heading["page"], "bbox": heading["bbox"],
+            "block_ids": [], "parent": stack[-1][1] if stack else None
+        })
+        stack.append((depth, i))
+    return sections
+
+
+def _heading_keys(sections):
+    pages = np.array([s["page"] - 1 for s in sections], dtype=np.int64)
+    ys = np.array([s["bbox"][1] for s in sections], dtype=np.float64)
+    return pages, ys
+
+
+def block_owners(heading_pages, heading_ys, block_pages, block_ys):
+    """
+    Vectorized y-range filter. Given the (page, y) positions of the section headings,
+    in order, returns for each block the index of the last heading strictly before
+    it, or -1 when there is none or a heading starts exactly at the block's y.
+    """
+    if not len(block_pages):
+        return np.zeros(0, dtype=np.int64)
+    # Rank the y values so (page, y) becomes one exact integer key
+    _, ranks = np.unique(np.concatenate([heading_ys, block_ys]), return_inverse=True)
+    ranks = ranks.reshape(-1)
+    scale = int(ranks.max()) + 1
+    heading_keys = heading_pages * scale + ranks[:len(heading_ys)]
+    block_keys = np.asarray(block_pages, dtype=np.int64) * scale + ranks[len(heading_ys):]
+    before = np.searchsorted(heading_keys, block_keys, side="left")
+    exact = np.searchsorted(heading_keys, block_keys, side="right") > before
+    return np.where((before > 0) & ~exact, before - 1, -1)
+
+
+def table_sections(title, outline, table):
+    """
+    sweep_sections over a whole columnar.BlockTable: every block is assigned with one
+    vectorized block_owners call instead of a per-page loop. Yields the same
+    (section, blocks) pairs, in document order.
+    """
+    sections = section_headings(title, outline, table.page_count)
+    heading_pages, heading_ys = _heading_keys(sections)
+    ids = np.flatnonzero(table.has_text)
+    pages = table.pages()[ids]
+    owners = block_owners(heading_pages, heading_ys, pages, table.bbox[ids, 1])
+
+    # Group by section; block ids ascend, so each group keeps page and reading order
+    assigned = owners >= 0
+    order = np.argsort(owners[assigned], kind="stable")
+    ids, pages, owners = ids[assigned][order], pages[assigned][order], owners[assigned][order]
+    bounds = np.searchsorted(owners, np.arange(len(sections) + 1))
+    local_ids = ids - table.page_offsets[pages]
+    for s, section in enumerate(sections):
+        start, stop = bounds[s], bounds[s + 1]
+        if stop > start:
+            section["block_ids"] = np.stack([pages[start:stop], local_ids[start:stop]], axis=1).tolist()
+            section["end_page"] = int(pages[stop - 1]) + 1
+        yield section, table.rows(ids[start:stop])
+
+
+def sweep_sections(title, outline, pages, page_count):
+    """
+    Assigns the text blocks of pages (an iterable of (page_idx, raw blocks), in page
+    order) to sections in one linear sweep. A section owns every block after its
+    heading and before the next heading, across page boundaries. The heading's own
+    line is excluded: blocks starting exactly at a heading's y belong to no section.
+
+    Yields (section, blocks) as soon as each section is complete, in document order.
+    A section lists its blocks as [page_idx, block_idx] ids in reading order within
+    each page, and carries its page span and parent section id.
+    """
+    sections = section_headings(title, outline, page_count)
+    heading_pages, heading_ys = _heading_keys(sections)
+    contents = [[] for _ in sections]
+    emitted = 0  # sections already yielded
+
+    for page_idx, blocks in pages:
+        text_ids = [b for b, block in enumerate(blocks) if block[4].strip()]
+        ys = np.array([blocks[b][1] for b in text_ids], dtype=np.float64)
+        owners = block_owners(heading_pages, heading_ys, np.full(len(text_ids), page_idx), ys)
+        # Keep the page's reading order inside each section
+        for b, owner in zip(text_ids, owners.tolist()):
+            if owner >= 0:
+                section = sections[owner]
+                section["block_ids"].append([page_idx, b])
+                section["end_page"] = page_idx + 1
+                contents[owner].append(blocks[b])
+
+        # Sections whose successor heading starts on this page or earlier are complete
+        opened = int(np.searchsorted(heading_pages, page_idx, side="right"))
+        while emitted < opened - 1:
+            yield sections[emitted], contents[emitted]
+            contents[emitted] = None
+            emitted += 1
+
+    while emitted < len(sections):
+        yield sections[emitted], contents[emitted]
+        emitted += 1
+
+
+def segment_sections(structure):
+    """
+    Returns the section tree of an extracted structure: one section per heading with
+    its page span, block ids and parent section id.
+    """
+    return [section for section, _ in table_sections(structure["title"], structure["outline"], structure["raw_blocks"])]
+
+
+def split_sentences(text):
+    """
+    Splits text into sentences at ., ! or ? followed by a capitalized word or a number.
+    Abbreviations (e.g., Fig., Dr.), initials (J. Smith, U.S.) and decimals (3.5) do not split.
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        if text[match.start()] == ".":
+            word = text[start:match.start()].rsplit(None, 1)[-1].lower() if text[start:match.start()].strip() else ""
+            word = word.lstrip("\"'([")
+            if word in ABBREVIATIONS or len(word.replace(".", "")) == 1 or re.fullmatch(r"(?:[a-z]\.)+[a-z]", word):
+                continue
+        sentence = text[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def section_chunk(section, blocks, pdf_path):
+    """
+    Builds the ranking chunk of a section from its blocks.
+    """
+    content_blocks = [block[4].replace('\n', ' ').strip() for block in blocks]
+    return {
+        "document": os.path.basename(pdf_path),
+        "page": section["page"],
+        "end_page": section["end_page"],
+        "section_id": section["id"],
+        "parent": section["parent"],
+        "section_title": section["title"],
+        "content": section["title"] + "\n" + "\n".join(content_blocks),
+        "content_blocks": content_blocks
+    }
@@ -0,0 +1,186 @@
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import threading
+import zlib
+
+import columnar
+import structure_extractor
+
+# Root of the on-disk cache; set STRUCTURE_CACHE_DIR to an empty string to disable caching
+CACHE_DIR = os.environ.get(
+    "STRUCTURE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "persona-doc-intel", "structures")
+)
+# Upper bound on the total size of the cache before least recently used entries are evicted
+MAX_CACHE_BYTES = int(os.environ.get("STRUCTURE_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+# Eviction frees space down to this fraction of the cap, so a full cache is not rescanned on every write
+EVICT_TO = 0.9
+
+_MAGIC = b"PDS1"
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Returns the SHA-256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def extractor_fingerprint():
+    """
+    Identifies the extraction logic: EXTRACTOR_VERSION, the heading classifier and a
+    hash of the structure_extractor and columnar sources, so any change to the
+    scoring heuristics produces new keys and old entries are simply never read again.
+    Computed once per process.
+    """
+    source = inspect.getsource(structure_extractor) + inspect.getsource(columnar)
+    digest = hashlib.sha256(
+        f"{structure_extractor.EXTRACTOR_VERSION}\0{structure_extractor.HEADING_CLASSIFIER}\0{source}".encode("utf-8")
+    )
+    return digest.hexdigest()[:16]
+
+
+class StructureCache:
+    """
+    Content-addressed cache of extract_structure results. Entries are
+    zlib-compressed pickles named after the PDF's content hash and the extractor
+    fingerprint. Reads refresh an entry's mtime, and writes evict the least
+    recently used entries once the cache grows past max_bytes. The total size is
+    tracked in memory (measured on the first write, then updated per write), so
+    the directory is only walked again when eviction is due.
+    The cache directory is trusted: only point it at a location you control.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fingerprint = extractor_fingerprint()
+        self._size = None
+        # One cache is shared by the threads of a process (see default_cache)
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key_for(self, pdf_path):
+        return f"{file_hash(pdf_path)}-{self.fingerprint}"
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.bin")
+
+    def get(self, key):
+        """
+        Returns the cached structure for key, or None on a miss or an unreadable entry.
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            if not data.startswith(_MAGIC):
+                raise ValueError("bad cache entry header")
+            structure = pickle.loads(zlib.decompress(data[len(_MAGIC):]))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Discarding unreadable cache entry '{path}': {e}")
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return structure
+
+    def put(self, key, structure):
+        """
+        Stores a structure under key. Error results are never cached.
+        """
+        if "error" in structure:
+            return
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = _MAGIC + zlib.compress(pickle.dumps(structure, protocol=pickle.HIGHEST_PROTOCOL))
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            try:
+                self._size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+            self._size += len(payload)
+            # Other processes sharing the directory are only seen at the next eviction
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        """
+        Returns the (mtime, size, path) of every entry and their total size.
+        """
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".bin"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return entries, total
+
+    def evict(self):
+        """
+        Deletes least recently used entries until the cache fits within EVICT_TO of max_bytes.
+        """
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        entries, total = self._scan()
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            self._remove(path)
+            total -= size
+        self._size = total
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_default_cache = None
+
+
+def default_cache():
+    """
+    Returns the process-wide StructureCache at CACHE_DIR (so its size is measured
+    once), or None when caching is disabled or the directory is unusable.
+    """
+    global _default_cache
+    if not CACHE_DIR:
+        return None
+    if _default_cache is None:
+        try:
+            _default_cache = StructureCache(CACHE_DIR)
+        except OSError as e:
+            print(f"Structure cache disabled, could not use '{CACHE_DIR}': {e}")
+            return None
+    return _default_cache
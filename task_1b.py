@@ -1,115 +1,243 @@
-from sentence_transformers import SentenceTransformer, util
 import numpy as np
 import os
 import json
+import heapq
+import threading
 from datetime import datetime, timezone
 
-from structure_extractor import extract_structure
-from utils import create_sample_pdfs
+from parallel import extract_structures
+from structure_cache import default_cache
+from embedding_store import default_store
+from utils import create_sample_pdfs, cos_sim
+from encoder import get_encoder
+from batching import encode_budgeted
+from vector_index import BruteForceIndex, top_k_indices
+from model_client import ModelClient
+from structure_extractor import iter_page_blocks, scan_headings
+from segmentation import section_chunk, split_sentences, sweep_sections, table_sections
+from lexical_index import RETRIEVAL_MODE, retrieve
+from dedup import DEDUP, deduplicate
+from instrumentation import enabled, instrumented, record_document, timer
 
 # --- Model Pre-loading and Caching ---
 model_name = 'all-MiniLM-L6-v2'
 model_path = './model'
+# Sentences kept per section as its refined_text
+REFINE_TOP_N = int(os.environ.get("REFINE_TOP_N", "1"))
+# Sections returned per query
+TOP_K = 5
+# Chunks embedded per batch by the streaming pipeline; bounds its peak memory
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "64"))
 
 
-if not os.path.exists(model_path):
-    print(f"Model not found locally. Downloading and saving '{model_name}' to '{model_path}'...")
-    model = SentenceTransformer(model_name)
-    model.save(model_path)
-    print("Model saved successfully.")
+def ensure_model():
+    """
+    Downloads and saves the model to model_path if it is not there yet.
+    """
+    if not os.path.exists(model_path):
+        from sentence_transformers import SentenceTransformer
+        print(f"Model not found locally. Downloading and saving '{model_name}' to '{model_path}'...")
+        model = SentenceTransformer(model_name)
+        model.save(model_path)
+        print("Model saved successfully.")
 # --- End of model pre-loading section ---
 
 
-def find_relevant_sections(pdf_paths: list, persona: str, job_to_be_done: str) -> dict:
+_model = None
+_model_lock = threading.Lock()
+# Serializes encode calls: the tokenizer and model are shared by every thread of a server process
+_encode_lock = threading.Lock()
+
+def load_model():
     """
-    Acts as an intelligent document analyst to find the most relevant sections.
+    Loads the embedding model from model_path once per process, using the backend
+    selected by EMBEDDING_BACKEND (see encoder.py). Only the sentence-transformers
+    backend imports torch.
+    """
+    global _model
+    with _model_lock:
+        if _model is None:
+            ensure_model()
+            _model = get_encoder(model_path)
+    return _model
+
+
+def encode_texts(model, texts):
+    """
+    Encodes texts into L2-normalized float32 NumPy vectors, with token-budgeted batches
+    and without truncation (long texts are pooled over windows; see batching.py).
+    """
+    with _encode_lock, timer("rank.encode"):
+        return encode_budgeted(model, texts)[0]
+
+
+def build_query(persona, job_to_be_done):
+    return f"Persona: {persona}. Task: {job_to_be_done}"
+
+
+def build_chunks(structure, pdf_path):
+    """
+    Splits an extracted structure into one chunk per section (the title counts as the
+    first heading): the text blocks from its heading up to the next heading, across
+    page boundaries. See segmentation.table_sections.
+    """
+    sections = table_sections(structure["title"], structure["outline"], structure["raw_blocks"])
+    return [section_chunk(section, blocks, pdf_path) for section, blocks in sections]
+
+
+def iter_chunks(pdf_path):
+    """
+    Streams the chunks of one PDF in build_chunks order without holding its pages:
+    a first pass finds the headings, a second pass sweeps the pages' blocks into
+    sections, emitting each one as soon as the next heading is reached.
+    Yields nothing (after a message) if the PDF cannot be opened.
     """
+    import fitz  # PyMuPDF
+
     try:
-        model = SentenceTransformer(model_path)
+        doc = fitz.open(pdf_path)
     except Exception as e:
-        return {"error": f"Failed to load model from '{model_path}'. Ensure the model exists. Error: {e}"}
-    
-    query = f"Persona: {persona}. Task: {job_to_be_done}"
-    query_embedding = model.encode(query, convert_to_tensor=True)
-    
-    all_chunks = []
+        print(f"Skipping file due to error: Could not open or process PDF {pdf_path}: {e}")
+        return
+    try:
+        structure = scan_headings(doc)
+        sections = sweep_sections(structure["title"], structure["outline"], iter_page_blocks(doc), doc.page_count)
+        for section, blocks in sections:
+            yield section_chunk(section, blocks, pdf_path)
+    finally:
+        doc.close()
 
-    for pdf_path in pdf_paths:
-        structure = extract_structure(pdf_path)
-        if "error" in structure:
-            print(f"Skipping file due to error: {structure['error']}")
-            continue
 
-        raw_blocks_by_page = structure["raw_blocks"]
-        headings = [{"text": structure["title"], "page": 1, "bbox": (0,0,0,90)}] + structure["outline"]
-        
-        for i, heading in enumerate(headings):
-            page_idx = heading["page"] - 1
-            if page_idx >= len(raw_blocks_by_page):
-                continue
-            page_blocks = raw_blocks_by_page[page_idx]
-            
-            heading_y_pos = heading["bbox"][1]
-            
-            next_heading_y_pos = float('inf')
-            if i + 1 < len(headings) and headings[i+1]["page"] == heading["page"]:
-                next_heading_y_pos = headings[i+1]["bbox"][1]
-            
-            content_blocks = [
-                block[4].replace('\n', ' ').strip() for block in page_blocks 
-                if block[1] > heading_y_pos and block[1] < next_heading_y_pos and block[4].strip()
-            ]
-            
-            full_content = heading["text"] + "\n" + "\n".join(content_blocks)
-            
-            all_chunks.append({
-                "document": os.path.basename(pdf_path),
-                "page": heading["page"],
-                "section_title": heading["text"],
-                "content": full_content,
-                "content_blocks": content_blocks
-            })
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-    if not all_chunks:
-        return {"error": "Could not extract any content from the documents."}
-        
-    chunk_contents = [chunk["content"] for chunk in all_chunks]
-    chunk_embeddings = model.encode(chunk_contents, convert_to_tensor=True)
-    
-    similarities = util.pytorch_cos_sim(query_embedding, chunk_embeddings)[0]
-    
-    ranked_chunks = sorted(zip(similarities.tolist(), all_chunks), key=lambda x: x[0], reverse=True)
-    
-    extracted_sections = []
-    sub_section_analysis = []
-    
-    for i, (score, chunk) in enumerate(ranked_chunks[:5]):
-        extracted_sections.append({
-            "document": chunk["document"], "page_number": chunk["page"],
-            "section_title": chunk["section_title"], "importance_rank": i + 1
-        })
-        
-        section_text = " ".join(chunk["content_blocks"])
-        sentences = section_text.split('. ')
-        sentences = [s.strip() + '.' for s in sentences if len(s.strip().split()) > 5]
-        
-        if sentences:
-            sent_embeddings = model.encode(sentences, convert_to_tensor=True)
-            sent_similarities = util.pytorch_cos_sim(query_embedding, sent_embeddings)[0]
-            most_relevant_sentence = sentences[np.argmax(sent_similarities.cpu().numpy())]
-            sub_section_analysis.append({
-                "document": chunk["document"], "page_number": chunk["page"],
-                "refined_text": most_relevant_sentence
-            })
-        else:
-            sub_section_analysis.append({
+
+def stream_top_chunks(query_embeddings, chunks, encode, top_k=5, batch_size=STREAM_BATCH_SIZE):
+    """
+    Ranks a stream of chunks for every query while keeping only a running top_k heap
+    per query: chunks are embedded batch_size at a time and dropped unless they make
+    a heap. Ties keep stream order, as in rank_sections_batch.
+    Returns, per query, its (at most top_k) best chunks, best first.
+    """
+    query_embeddings = np.atleast_2d(query_embeddings)
+    heaps = [[] for _ in range(len(query_embeddings))]
+    seq = 0
+    for batch in iter_batches(chunks, batch_size):
+        similarities = cos_sim(query_embeddings, encode([chunk["content"] for chunk in batch]))
+        for j, chunk in enumerate(batch):
+            for heap, score in zip(heaps, similarities[:, j].tolist()):
+                # (score, -seq): among equal scores the later chunk is evicted first
+                entry = (score, -(seq + j), chunk)
+                if len(heap) < top_k:
+                    heapq.heappush(heap, entry)
+                elif entry[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, entry)
+        seq += len(batch)
+    return [[chunk for _, _, chunk in sorted(heap, key=lambda e: e[:2], reverse=True)] for heap in heaps]
+
+
+def chunk_sentences(chunk):
+    """
+    Splits a chunk's content into the candidate sentences used for refinement:
+    those of more than five words.
+    """
+    section_text = " ".join(chunk["content_blocks"])
+    return [s for s in split_sentences(section_text) if len(s.split()) > 5]
+
+
+def rank_sections_batch(query_embeddings, chunks, chunk_embeddings, encode_sentences, top_k=5):
+    """
+    Ranks chunks for many queries at once: one (queries x chunks) matrix product,
+    a top_k selection per row, and a single encode of the sentences of every
+    selected chunk, which are shared across queries for refinement.
+    encode_sentences maps a list of sentences to their embeddings.
+    Returns one (extracted_sections, sub_section_analysis) pair per query.
+    """
+    _, top_indices = BruteForceIndex(chunk_embeddings).search(query_embeddings, top_k)
+    return refine_sections(query_embeddings, chunks, top_indices, encode_sentences)
+
+
+def refine_sections(query_embeddings, chunks, top_indices, encode_sentences, top_n=REFINE_TOP_N):
+    """
+    Builds the output sections for already selected chunks (one row of chunk ids per
+    query, best first; negative ids are padding) and refines each to its top_n most
+    relevant sentences, joined in reading order.
+    The sentences of every selected chunk are encoded in one call (the encoders sort
+    it by length into padded batches) and scored for all queries with one matrix
+    product; the best sentences of each (query, chunk) pair come from one top-n
+    selection over a padded (query, chunk, sentence) score tensor.
+    """
+    query_embeddings = np.atleast_2d(query_embeddings)
+    top_indices = [[i for i in row if i >= 0] for row in np.atleast_2d(top_indices).tolist()]
+
+    # Gather the sentences of every selected chunk once, across all queries
+    selected = list(dict.fromkeys(i for row in top_indices for i in row))
+    column = {chunk_idx: c for c, chunk_idx in enumerate(selected)}
+    sentence_rows = {}
+    chunk_rows = []
+    for chunk_idx in selected:
+        chunk_rows.append([sentence_rows.setdefault(s, len(sentence_rows)) for s in chunk_sentences(chunks[chunk_idx])])
+
+    sentences = list(sentence_rows)
+    best = {}
+    if sentences:
+        width = max(len(rows) for rows in chunk_rows)
+        padded = np.full((len(selected), width), -1, dtype=np.int64)
+        for c, rows in enumerate(chunk_rows):
+            padded[c, :len(rows)] = rows
+        similarities = cos_sim(query_embeddings, encode_sentences(sentences))
+        segment_scores = np.where(padded >= 0, similarities[:, padded], -np.inf)
+        ranked = top_k_indices(segment_scores.reshape(-1, width), max(top_n, 1)).reshape(len(query_embeddings), len(selected), -1)
+        for q in range(len(query_embeddings)):
+            for c, rows in enumerate(chunk_rows):
+                positions = sorted(p for p in ranked[q, c].tolist() if p < len(rows))
+                best[q, c] = " ".join(sentences[rows[p]] for p in positions)
+
+    results = []
+    for q, row in enumerate(top_indices):
+        extracted_sections = []
+        sub_section_analysis = []
+        for i, chunk_idx in enumerate(row):
+            chunk = chunks[chunk_idx]
+            extracted_sections.append({
                 "document": chunk["document"], "page_number": chunk["page"],
-                "refined_text": chunk["section_title"]
+                "section_title": chunk["section_title"], "importance_rank": i + 1
             })
 
+            if chunk_rows[column[chunk_idx]]:
+                sub_section_analysis.append({
+                    "document": chunk["document"], "page_number": chunk["page"],
+                    "refined_text": best[q, column[chunk_idx]]
+                })
+            else:
+                sub_section_analysis.append({
+                    "document": chunk["document"], "page_number": chunk["page"],
+                    "refined_text": chunk["section_title"]
+                })
+        results.append((extracted_sections, sub_section_analysis))
+
+    return results
+
+
+def rank_sections(query_embedding, chunks, chunk_embeddings, encode_sentences, top_k=5):
+    """
+    Ranks chunks by similarity to the query and refines each of the top_k to its most
+    relevant sentence. Returns (extracted_sections, sub_section_analysis).
+    """
+    return rank_sections_batch(query_embedding, chunks, chunk_embeddings, encode_sentences, top_k=top_k)[0]
+
+
+def build_output(documents, persona, job_to_be_done, extracted_sections, sub_section_analysis):
     return {
         "metadata": {
-            "input_documents": [os.path.basename(p) for p in pdf_paths],
+            "input_documents": documents,
             "persona": persona, "job_to_be_done": job_to_be_done,
             "processing_timestamp": datetime.now(timezone.utc).isoformat()
         },
@@ -117,6 +245,196 @@ def find_relevant_sections(pdf_paths: list, persona: str, job_to_be_done: str) -
         "sub_section_analysis": sub_section_analysis
     }
 
+
+def collect_chunks(pdf_paths, structures, model=None):
+    """
+    Builds the chunks of every extracted structure, skipping failed documents, and
+    records per-document stats on the current instrumentation run. Token counts are
+    only computed (with model's tokenizer) when metrics are exported.
+    """
+    all_chunks = []
+    for pdf_path, structure in zip(pdf_paths, structures):
+        if "error" in structure:
+            print(f"Skipping file due to error: {structure['error']}")
+            continue
+        with timer("rank.chunking"):
+            chunks = build_chunks(structure, pdf_path)
+        stats = {
+            "pages": structure["raw_blocks"].page_count,
+            "blocks": structure["raw_blocks"].block_count,
+            "headings": len(structure["outline"]),
+            "chunks": len(chunks)
+        }
+        if model is not None and enabled():
+            stats["tokens"] = sum(len(ids) for ids in model.token_ids([chunk["content"] for chunk in chunks]))
+        record_document(os.path.basename(pdf_path), **stats)
+        all_chunks.extend(chunks)
+    return all_chunks
+
+
+def dedupe_stage(chunks, encode):
+    """
+    Runs the near-duplicate detection of dedup.deduplicate when DEDUP=1.
+    Returns the chunks to rank and the encode function to use for them.
+    """
+    if not DEDUP:
+        return chunks, encode
+    with timer("rank.dedup"):
+        return deduplicate(chunks, encode)
+
+
+def report_dedup(encode):
+    if getattr(encode, "saved", 0):
+        print(f"Deduplication saved {encode.saved} encode(s).")
+
+
+@instrumented("find_relevant_sections")
+def find_relevant_sections(pdf_paths: list, persona: str, job_to_be_done: str, workers: int = None,
+                           mode: str = RETRIEVAL_MODE, executor=None) -> dict:
+    """
+    Acts as an intelligent document analyst to find the most relevant sections.
+    The PDFs are parsed in parallel by `workers` processes (defaults to PDF_WORKERS or the CPU count),
+    or on a long-lived executor (see parallel.new_pool) shared across calls.
+    mode selects semantic, BM25-filtered or hybrid retrieval (see lexical_index.retrieve).
+    """
+    try:
+        model = load_model()
+    except Exception as e:
+        return {"error": f"Failed to load model from '{model_path}'. Ensure the model exists. Error: {e}"}
+
+    def encode(texts):
+        return encode_texts(model, texts)
+
+    def extract(paths):
+        return extract_structures(paths, workers=workers, cache=default_cache(), executor=executor)
+
+    return rank_documents(pdf_paths, persona, job_to_be_done, model, encode, extract, mode)
+
+def rank_documents(pdf_paths, persona, job_to_be_done, model, encode, extract, mode=RETRIEVAL_MODE):
+    """
+    The body of find_relevant_sections with the encoder and the extractor supplied by
+    the caller: encode maps texts to normalized vectors and extract maps PDF paths to
+    structures. The scheduler uses it to share one model and one worker pool.
+    """
+    # Section and sentence vectors are reused across queries; only the query itself is always encoded
+    store = default_store(model.model_id)
+    encode_cached = (lambda texts: store.encode(texts, encode)) if store is not None else encode
+    
+    query = build_query(persona, job_to_be_done)
+    with timer("rank.encode_query"):
+        query_embedding = encode([query])[0]
+    
+    with timer("rank.extract"):
+        structures = extract(pdf_paths)
+    all_chunks = collect_chunks(pdf_paths, structures, model)
+
+    if not all_chunks:
+        return {"error": "Could not extract any content from the documents."}
+    all_chunks, encode_cached = dedupe_stage(all_chunks, encode_cached)
+        
+    with timer("rank.retrieve"):
+        top_indices = retrieve([query], query_embedding, all_chunks, encode_cached, mode=mode)
+    with timer("rank.refine"):
+        extracted_sections, sub_section_analysis = refine_sections(
+            query_embedding, all_chunks, top_indices, encode_cached
+        )[0]
+    report_dedup(encode_cached)
+
+    return build_output(
+        [os.path.basename(p) for p in pdf_paths], persona, job_to_be_done,
+        extracted_sections, sub_section_analysis
+    )
+
+@instrumented("find_relevant_sections_batch")
+def find_relevant_sections_batch(pdf_paths: list, queries: list, workers: int = None,
+                                 mode: str = RETRIEVAL_MODE, executor=None, top_k: int = TOP_K) -> list:
+    """
+    Answers many (persona, job_to_be_done) pairs against the same PDFs in one pass:
+    the documents are parsed, chunked and embedded once, all queries are encoded in
+    one batch and ranked with a single matrix product. Returns one result per query,
+    each in the find_relevant_sections output schema with its top_k sections.
+    executor is as in find_relevant_sections.
+    """
+    try:
+        model = load_model()
+    except Exception as e:
+        return [{"error": f"Failed to load model from '{model_path}'. Ensure the model exists. Error: {e}"} for _ in queries]
+
+    def encode(texts):
+        return encode_texts(model, texts)
+
+    store = default_store(model.model_id)
+    encode_cached = (lambda texts: store.encode(texts, encode)) if store is not None else encode
+
+    with timer("rank.extract"):
+        structures = extract_structures(pdf_paths, workers=workers, cache=default_cache(), executor=executor)
+    all_chunks = collect_chunks(pdf_paths, structures, model)
+
+    if not all_chunks:
+        return [{"error": "Could not extract any content from the documents."} for _ in queries]
+    all_chunks, encode_cached = dedupe_stage(all_chunks, encode_cached)
+
+    query_texts = [build_query(persona, job) for persona, job in queries]
+    with timer("rank.encode_query"):
+        query_embeddings = encode(query_texts)
+
+    with timer("rank.retrieve"):
+        top_indices = retrieve(query_texts, query_embeddings, all_chunks, encode_cached, top_k=top_k, mode=mode)
+    with timer("rank.refine"):
+        ranked = refine_sections(query_embeddings, all_chunks, top_indices, encode_cached)
+    report_dedup(encode_cached)
+    documents = [os.path.basename(p) for p in pdf_paths]
+    return [
+        build_output(documents, persona, job, extracted_sections, sub_section_analysis)
+        for (persona, job), (extracted_sections, sub_section_analysis) in zip(queries, ranked)
+    ]
+
+@instrumented("find_relevant_sections_streaming")
+def find_relevant_sections_streaming(pdf_paths: list, queries: list, top_k: int = TOP_K,
+                                     batch_size: int = STREAM_BATCH_SIZE) -> list:
+    """
+    Bounded-memory variant of find_relevant_sections_batch for very large documents.
+    Pages, chunks and embedding batches flow through generators, and ranking keeps
+    only a running top_k heap per query, so peak memory depends on batch_size rather
+    than on the corpus size. PDFs are read one after another and the structure cache
+    is not used. Returns one result per (persona, job_to_be_done) query.
+    """
+    try:
+        model = load_model()
+    except Exception as e:
+        return [{"error": f"Failed to load model from '{model_path}'. Ensure the model exists. Error: {e}"} for _ in queries]
+
+    def encode(texts):
+        return encode_texts(model, texts)
+
+    store = default_store(model.model_id)
+    encode_cached = (lambda texts: store.encode(texts, encode)) if store is not None else encode
+
+    with timer("rank.encode_query"):
+        query_embeddings = encode([build_query(persona, job) for persona, job in queries])
+    chunks = (chunk for pdf_path in pdf_paths for chunk in iter_chunks(pdf_path))
+    # Parsing, chunking and embedding are interleaved here, so they are timed as one stage
+    with timer("rank.stream"):
+        top_chunks = stream_top_chunks(query_embeddings, chunks, encode_cached, top_k=top_k, batch_size=batch_size)
+    if not any(top_chunks):
+        return [{"error": "Could not extract any content from the documents."} for _ in queries]
+
+    # Refine only the selected chunks, each once across queries
+    selected = {}
+    top_indices = [[selected.setdefault(id(chunk), (len(selected), chunk))[0] for chunk in row] for row in top_chunks]
+    selected_chunks = [chunk for _, chunk in selected.values()]
+    padded = np.full((len(queries), top_k), -1, dtype=np.int64)
+    for q, row in enumerate(top_indices):
+        padded[q, :len(row)] = row
+    with timer("rank.refine"):
+        ranked = refine_sections(query_embeddings, selected_chunks, padded, encode_cached)
+
+    documents = [os.path.basename(p) for p in pdf_paths]
+    return [
+        build_output(documents, persona, job, extracted_sections, sub_section_analysis)
+        for (persona, job), (extracted_sections, sub_section_analysis) in zip(queries, ranked)
+    ]
+
 if __name__ == '__main__':
     create_sample_pdfs()
     
@@ -126,7 +444,13 @@ if __name__ == '__main__':
     persona_1b = "An investment analyst with expertise in the tech sector."
     job_1b = "Analyze revenue trends and R&D investments to understand market positioning."
 
-    analysis_data = find_relevant_sections(pdf_paths_1b, persona_1b, job_1b)
+    # Use the resident model server when one is running, otherwise load the model here
+    client = ModelClient()
+    if client.available():
+        print(f"Using model server at {client.url}")
+        analysis_data = client.find_relevant_sections(pdf_paths_1b, persona_1b, job_1b)
+    else:
+        analysis_data = find_relevant_sections(pdf_paths_1b, persona_1b, job_1b)
     
     output_filename = "challenge1b_output.json"
     with open(output_filename, 'w', encoding='utf-8') as f:
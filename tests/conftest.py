@@ -0,0 +1,41 @@
+import os
+import sys
+
+# Keep test runs out of the user's caches; these are read when the modules are imported
+os.environ["STRUCTURE_CACHE_DIR"] = ""
+os.environ["EMBEDDING_STORE_DIR"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from utils import create_synthetic_corpus
+
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory):
+    """
+    A small synthetic corpus: three 4-page reports with numbered headings, 1 and 2 columns.
+    """
+    return create_synthetic_corpus(str(tmp_path_factory.mktemp("corpus")), documents=3, pages=4, columns=(1, 2))
+
+
+@pytest.fixture(scope="session")
+def model():
+    """
+    The embedding model at ./model; tests that rank are skipped when it cannot be loaded.
+    """
+    from task_1b import load_model, model_path
+
+    if not os.path.exists(model_path):
+        pytest.skip(f"no model at '{model_path}'")
+    try:
+        return load_model()
+    except Exception as e:
+        pytest.skip(f"could not load the model at '{model_path}': {e}")
+
+
+def sections(result):
+    """
+    The ranked part of a find_relevant_sections result, without the timestamped metadata.
+    """
+    return result["extracted_sections"], result["sub_section_analysis"]
@@ -0,0 +1,22 @@
+import asyncio
+
+from async_api import AsyncAnalyzer
+from conftest import sections
+from task_1b import find_relevant_sections
+
+QUERIES = [
+    ("A financial analyst.", "Summarize the revenue and cost figures."),
+    ("A research engineer.", "Find the evaluation methodology and results."),
+]
+
+
+def test_async_matches_find_relevant_sections(corpus, model):
+    async def run():
+        async with AsyncAnalyzer(workers=1) as analyzer:
+            return await asyncio.gather(*(
+                analyzer.find_relevant_sections(corpus, persona, job, timeout=300) for persona, job in QUERIES
+            ))
+
+    results = asyncio.run(run())
+    for result, (persona, job) in zip(results, QUERIES):
+        assert sections(result) == sections(find_relevant_sections(corpus, persona, job, workers=1))
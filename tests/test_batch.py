@@ -0,0 +1,21 @@
+from conftest import sections
+from task_1b import find_relevant_sections, find_relevant_sections_batch, find_relevant_sections_streaming
+
+QUERIES = [
+    ("A financial analyst.", "Summarize the revenue and cost figures."),
+    ("A research engineer.", "Find the evaluation methodology and results."),
+]
+
+
+def test_single_batch_and_streaming_agree(corpus, model):
+    single = [find_relevant_sections(corpus, persona, job, workers=1, mode="semantic") for persona, job in QUERIES]
+    batch = find_relevant_sections_batch(corpus, QUERIES, workers=1, mode="semantic")
+    streaming = find_relevant_sections_streaming(corpus, QUERIES)
+    for one, batched, streamed in zip(single, batch, streaming):
+        assert sections(batched) == sections(one)
+        assert sections(streamed) == sections(one)
+
+
+def test_batch_honours_top_k(corpus, model):
+    results = find_relevant_sections_batch(corpus, QUERIES, workers=1, mode="semantic", top_k=2)
+    assert [len(result["extracted_sections"]) for result in results] == [2, 2]
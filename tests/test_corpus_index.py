@@ -0,0 +1,28 @@
+from conftest import sections
+from corpus_index import CorpusIndex, build_index, compact_index, update_index
+from task_1b import find_relevant_sections
+
+PERSONA = "A financial analyst."
+JOB = "Summarize the revenue and cost figures."
+
+
+def assert_index_matches_direct_query(index_dir, corpus):
+    index = CorpusIndex(index_dir)
+    paths = {path.rsplit("/", 1)[-1]: path for path in corpus}
+    direct = find_relevant_sections([paths[name] for name in index.documents], PERSONA, JOB, workers=1, mode="semantic")
+    assert sections(index.query(PERSONA, JOB)) == sections(direct)
+
+
+def test_index_query_matches_direct_query_after_update_and_compact(corpus, model, tmp_path):
+    index_dir = str(tmp_path / "index")
+    build_index(corpus[:2], index_dir, workers=1, vector_index="flat")
+    assert_index_matches_direct_query(index_dir, corpus)
+
+    # Tombstone one document without compacting, then add another
+    report = update_index(index_dir, corpus[2:], remove=[corpus[0]], workers=1, compact_fraction=1.0)
+    assert report["removed"] and report["added"] and not report["compacted"]
+    assert_index_matches_direct_query(index_dir, corpus)
+
+    manifest = compact_index(index_dir)
+    assert manifest["dead_chunks"] == 0
+    assert_index_matches_direct_query(index_dir, corpus)
@@ -0,0 +1,9 @@
+from encoder import embedding_model_id
+from task_1b import model_path
+
+
+def test_backends_share_an_id_only_when_their_vectors_match():
+    ids = {backend: embedding_model_id(model_path, backend)
+           for backend in ("sentence-transformers", "onnx", "onnx-int8", "sentence-transformers-int8")}
+    assert ids["sentence-transformers"] == ids["onnx"]
+    assert len({ids["onnx"], ids["onnx-int8"], ids["sentence-transformers-int8"]}) == 3
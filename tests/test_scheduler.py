@@ -0,0 +1,17 @@
+from conftest import sections
+from scheduler import Scheduler
+from task_1b import find_relevant_sections
+
+QUERIES = [
+    ("A financial analyst.", "Summarize the revenue and cost figures."),
+    ("A research engineer.", "Find the evaluation methodology and results."),
+]
+
+
+def test_scheduler_matches_find_relevant_sections(corpus, model):
+    expected = [find_relevant_sections(corpus, persona, job, workers=1) for persona, job in QUERIES]
+    with Scheduler(max_jobs=2, workers=1, batch_texts=16) as scheduler:
+        jobs = [scheduler.submit(corpus, persona, job, name=f"job{i}") for i, (persona, job) in enumerate(QUERIES)]
+        results = [job.result(timeout=300) for job in jobs]
+    for result, direct in zip(results, expected):
+        assert sections(result) == sections(direct)
@@ -0,0 +1,32 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from parallel import extract_structure_sharded, extract_structures
+from structure_cache import StructureCache
+
+
+def assert_same_structure(sharded, plain):
+    assert sharded["title"] == plain["title"]
+    assert sharded["outline"] == plain["outline"]
+    assert list(sharded["raw_blocks"]) == list(plain["raw_blocks"])
+
+
+def test_sharded_extraction_matches_unsharded(corpus):
+    plain = extract_structures(corpus, workers=1)
+    sharded = extract_structures(corpus, workers=2, shard_min_pages=1)
+    for a, b in zip(sharded, plain):
+        assert_same_structure(a, b)
+
+
+def test_sharded_extraction_on_shared_executor(corpus):
+    plain = extract_structures(corpus, workers=1)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        sharded = extract_structures(corpus, executor=executor, shard_min_pages=1)
+    for a, b in zip(sharded, plain):
+        assert_same_structure(a, b)
+
+
+def test_sharded_extraction_is_cached(corpus, tmp_path):
+    cache = StructureCache(str(tmp_path))
+    first = extract_structure_sharded(corpus[0], workers=2, cache=cache)
+    assert cache.get(cache.key_for(corpus[0])) is not None
+    assert_same_structure(extract_structure_sharded(corpus[0], workers=2, cache=cache), first)
@@ -0,0 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from parallel import extract_structures
+from structure_cache import StructureCache
+
+
+def test_threads_share_a_cache(corpus, tmp_path):
+    cache = StructureCache(str(tmp_path))
+    with ThreadPoolExecutor(max_workers=4) as threads:
+        runs = list(threads.map(lambda _: extract_structures(corpus, workers=1, cache=cache), range(4)))
+    for run in runs:
+        assert [structure["outline"] for structure in run] == [structure["outline"] for structure in runs[0]]
+    assert all(cache.get(cache.key_for(path)) is not None for path in corpus)
+
+
+def test_failed_cache_write_keeps_results(corpus, tmp_path):
+    cache = StructureCache(str(tmp_path))
+
+    def put(key, structure):
+        raise OSError("No space left on device")
+
+    cache.put = put
+    structures = extract_structures(corpus, workers=1, cache=cache)
+    assert all("error" not in structure for structure in structures)
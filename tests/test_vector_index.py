@@ -0,0 +1,17 @@
+import numpy as np
+
+from vector_index import BruteForceIndex, IVFIndex, recall_at_k
+
+
+def test_recall_ignores_padding():
+    assert recall_at_k([[3, -1, -1]], [[3, 5, -1]]) == 0.5
+    assert recall_at_k([[-1, -1]], [[-1, -1]]) == 1.0
+
+
+def test_flat_and_ivf_pad_to_k():
+    vectors = np.random.RandomState(0).rand(3, 8).astype(np.float32)
+    flat_scores, flat_ids = BruteForceIndex(vectors).search(vectors[:2], 5)
+    _, ivf_ids = IVFIndex.train(vectors, n_lists=1).search(vectors[:2], 5)
+    assert flat_ids.shape == flat_scores.shape == ivf_ids.shape == (2, 5)
+    assert (flat_ids[:, 3:] == -1).all() and np.isneginf(flat_scores[:, 3:]).all()
+    assert flat_ids.tolist() == ivf_ids.tolist()
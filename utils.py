@@ -1,8 +1,31 @@
-import fitz  # PyMuPDF
+import numpy as np
 import os
+import random
+
+# Base-14 fonts usable by the synthetic generator: regular and bold name of each family
+SYNTHETIC_FONTS = {"helv": ("helv", "hebo"), "times": ("tiro", "tibo"), "courier": ("cour", "cobo")}
+# Heading font sizes by depth (1 = H1); deeper levels reuse the last size
+HEADING_SIZES = [20, 16, 14, 13, 12]
+_WORDS = (
+    "revenue growth market analysis network graph model data research method result cloud "
+    "investment strategy risk compliance regulation product customer quarter forecast protein "
+    "molecule training dataset evaluation performance policy segment margin supply demand"
+).split()
+
+def cos_sim(a, b):
+    """
+    Cosine similarity between the rows of a and b (1D inputs are treated as a single row).
+    Returns a (len(a), len(b)) NumPy matrix.
+    """
+    a = np.atleast_2d(np.asarray(a, dtype=np.float32))
+    b = np.atleast_2d(np.asarray(b, dtype=np.float32))
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return a @ b.T
 
 def create_sample_pdfs():
     """Generates two sample PDFs for demonstration if they don't exist."""
+    import fitz  # PyMuPDF
     
     pdf1_path = "gnn_report.pdf"
     pdf2_path = "business_report.pdf"
@@ -16,10 +39,10 @@ def create_sample_pdfs():
     try:
         doc1 = fitz.open()
         page1 = doc1.new_page()
-        page1.insert_text((72, 72), "Graph Neural Networks for Drug Discovery", fontsize=24, fontname="helv-bold")
-        page1.insert_text((72, 120), "1. Introduction", fontsize=18, fontname="helv-bold")
+        page1.insert_text((72, 72), "Graph Neural Networks for Drug Discovery", fontsize=24, fontname="hebo")
+        page1.insert_text((72, 120), "1. Introduction", fontsize=18, fontname="hebo")
         page1.insert_text((72, 140), "The application of GNNs in computational biology is rapidly expanding. This report explores their use in drug discovery, focusing on methodologies and datasets. The primary challenge is representing complex molecular structures as graphs.", fontsize=12, fontname="helv")
-        page1.insert_text((72, 200), "1.1 Prior Research", fontsize=14, fontname="helv-bold")
+        page1.insert_text((72, 200), "1.1 Prior Research", fontsize=14, fontname="hebo")
         page1.insert_text((72, 220), "Previous work by Smith et al. used convolutional networks. However, GNNs provide a more flexible framework for non-euclidean data like molecules. Our methodology builds upon this foundational research.", fontsize=12, fontname="helv")
         doc1.save(pdf1_path)
         doc1.close()
@@ -27,10 +50,10 @@ def create_sample_pdfs():
         # --- PDF 2: Business Analysis ---
         doc2 = fitz.open()
         page2 = doc2.new_page()
-        page2.insert_text((72, 72), "TechCorp Annual Report 2024", fontsize=24, fontname="helv-bold")
-        page2.insert_text((72, 120), "A. Executive Summary", fontsize=18, fontname="helv-bold")
+        page2.insert_text((72, 72), "TechCorp Annual Report 2024", fontsize=24, fontname="hebo")
+        page2.insert_text((72, 120), "A. Executive Summary", fontsize=18, fontname="hebo")
         page2.insert_text((72, 140), "2024 was a year of significant growth. Total revenue increased by 20%, driven by our cloud division. We are analyzing revenue trends closely.", fontsize=12, fontname="helv")
-        page2.insert_text((72, 200), "B. Financials", fontsize=18, fontname="helv-bold")
+        page2.insert_text((72, 200), "B. Financials", fontsize=18, fontname="hebo")
         page2.insert_text((72, 220), "R&D investments grew by 30% to fuel innovation in AI. This strategic investment is crucial for our market positioning against competitors.", fontsize=12, fontname="helv")
         doc2.save(pdf2_path)
         doc2.close()
@@ -39,3 +62,81 @@ def create_sample_pdfs():
         print(f"Error creating sample PDFs: {e}")
         print("Please ensure you have write permissions and PyMuPDF is installed correctly.")
 
+
+
+def _synthetic_sentence(rng):
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(6, 16))]
+    if rng.random() < 0.1:
+        words.insert(rng.randrange(len(words)), f"ISO-{rng.randint(1000, 99999)}")
+    return " ".join(words).capitalize() + "."
+
+
+def create_synthetic_pdf(path, pages=10, heading_depth=3, numbered=True, font="helv", columns=1,
+                         paragraphs_per_page=4, seed=0):
+    """
+    Writes a synthetic report to path for benchmarking: a title, then on each page a
+    mix of headings (levels 1..heading_depth, optionally numbered "1.", "1.2", ...)
+    and body paragraphs of random sentences, laid out in 1 or 2 columns with one of
+    the SYNTHETIC_FONTS families. Returns the number of headings written.
+    """
+    import fitz  # PyMuPDF
+
+    rng = random.Random(seed)
+    regular, bold = SYNTHETIC_FONTS[font]
+    counters = [0] * heading_depth
+    headings = 0
+
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        width, height = page.rect.width, page.rect.height
+        margin, gap = 54, 18
+        column_width = (width - 2 * margin - gap * (columns - 1)) / columns
+        column, y = 0, margin
+        if page_num == 0:
+            page.insert_text((margin, y + 24), f"Synthetic Report {seed}", fontsize=24, fontname=bold)
+            y += 48
+
+        for _ in range(paragraphs_per_page):
+            x = margin + column * (column_width + gap)
+            if rng.random() < 0.5:
+                level = rng.randint(1, heading_depth)
+                counters[level - 1] += 1
+                counters[level:] = [0] * (heading_depth - level)
+                label = " ".join(rng.choice(_WORDS).capitalize() for _ in range(rng.randint(2, 4)))
+                if numbered:
+                    label = ".".join(str(max(c, 1)) for c in counters[:level]) + ". " + label
+                size = HEADING_SIZES[min(level, len(HEADING_SIZES)) - 1]
+                page.insert_text((x, y + size), label, fontsize=size, fontname=bold)
+                y += size + 12
+                headings += 1
+
+            text = " ".join(_synthetic_sentence(rng) for _ in range(rng.randint(2, 5)))
+            box = fitz.Rect(x, y, x + column_width, height - margin)
+            rc = page.insert_textbox(box, text, fontsize=10, fontname=regular)
+            y += (box.height - rc if rc >= 0 else 0) + 14
+            if y > height - margin - 80:
+                if column + 1 >= columns:
+                    break
+                column, y = column + 1, margin
+    doc.save(path)
+    doc.close()
+    return headings
+
+
+def create_synthetic_corpus(out_dir, documents=5, pages=10, heading_depth=3, numbered=True,
+                            fonts=("helv",), columns=(1,), seed=0):
+    """
+    Writes `documents` synthetic PDFs into out_dir, cycling through fonts and column
+    layouts, and returns their paths.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i in range(documents):
+        path = os.path.join(out_dir, f"synthetic_{i:03d}.pdf")
+        create_synthetic_pdf(
+            path, pages=pages, heading_depth=heading_depth, numbered=numbered,
+            font=fonts[i % len(fonts)], columns=columns[i % len(columns)], seed=seed + i
+        )
+        paths.append(path)
+    return paths
@@ -0,0 +1,285 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from utils import cos_sim
+
+# Corpora with fewer vectors than this are searched exactly when the index kind is "auto"
+AUTO_IVF_THRESHOLD = 50000
+# Lists probed per query by default, as a fraction of the IVF list count (at least one list)
+DEFAULT_NPROBE_FRACTION = 0.05
+# Rows scored per matrix product, bounding the temporary memory of a search or an assignment
+SEARCH_BLOCK_ROWS = 65536
+
+
+def top_k_indices(similarities, k):
+    """
+    Returns, for each row of a (queries x items) similarity matrix, the indices of
+    its k best items, best first. Uses a partial selection instead of a full sort;
+    equal scores keep item order, like a stable sort would.
+    """
+    similarities = np.atleast_2d(similarities)
+    n = similarities.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros((similarities.shape[0], 0), dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        # argpartition picks arbitrarily among items tied with the k-th score; where it
+        # left out an earlier one, fall back to a stable sort of that row
+        kth = np.take_along_axis(similarities, candidates, axis=1).min(axis=1, keepdims=True)
+        tied_rows = np.flatnonzero(
+            (similarities == kth).sum(axis=1) > (np.take_along_axis(similarities, candidates, axis=1) == kth).sum(axis=1)
+        )
+        for row in tied_rows:
+            candidates[row] = np.argsort(-similarities[row], kind="stable")[:k]
+    else:
+        candidates = np.tile(np.arange(n), (similarities.shape[0], 1))
+    scores = np.take_along_axis(similarities, candidates, axis=1)
+    order = np.lexsort((candidates, -scores), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def _pad_removed(scores, ids):
+    # Removed rows score -inf; report them as padding
+    ids[np.isneginf(scores)] = -1
+    return scores, ids
+
+
+class BruteForceIndex:
+    """
+    Exact search: cosine similarity against every vector, then a partial top-k selection.
+    """
+    kind = "flat"
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.live = None
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def add(self, vectors):
+        """
+        Switches to vectors, the current matrix with new rows appended.
+        """
+        self.vectors = vectors
+        if self.live is not None:
+            self.live = np.concatenate([self.live, np.ones(len(vectors) - len(self.live), dtype=bool)])
+
+    def remove(self, ids):
+        """
+        Tombstones rows: they stay in the matrix but are never returned by search.
+        """
+        if self.live is None:
+            self.live = np.ones(len(self.vectors), dtype=bool)
+        self.live[np.asarray(ids, dtype=np.int64)] = False
+
+    def search(self, queries, k):
+        """
+        Returns (scores, ids), both (len(queries), k), best first. When fewer than k
+        rows are live, the tail is padded with score -inf and id -1.
+        """
+        similarities = cos_sim(queries, self.vectors)
+        if self.live is not None:
+            similarities[:, ~self.live] = -np.inf
+        best = top_k_indices(similarities, k)
+        scores = np.full((len(similarities), k), -np.inf, dtype=similarities.dtype)
+        ids = np.full((len(similarities), k), -1, dtype=np.int64)
+        scores[:, :best.shape[1]] = np.take_along_axis(similarities, best, axis=1)
+        ids[:, :best.shape[1]] = best
+        return _pad_removed(scores, ids)
+
+    def save(self, index_dir):
+        with open(os.path.join(index_dir, "vector_index.json"), "w", encoding="utf-8") as f:
+            json.dump({"kind": self.kind}, f)
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def _assign(vectors, centroids):
+    """
+    Index of the most similar centroid for every row of vectors, computed block by block.
+    """
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+        block = _normalize(vectors[start:start + SEARCH_BLOCK_ROWS])
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate index: spherical k-means splits the vectors into lists,
+    and a query only scores the vectors of its nprobe most similar lists.
+    The vectors themselves are not copied; the index keeps the list membership only.
+    """
+    kind = "ivf"
+
+    def __init__(self, vectors, centroids, assignments, nprobe=None):
+        self.vectors = vectors
+        self.centroids = centroids.astype(np.float32)
+        self.assignments = assignments.astype(np.int64)
+        self.nprobe = nprobe or max(1, int(round(len(centroids) * DEFAULT_NPROBE_FRACTION)))
+        self.live = None
+        self._build_lists()
+
+    def __len__(self):
+        return len(self.assignments)
+
+    def _build_lists(self):
+        order = np.argsort(self.assignments, kind="stable")
+        counts = np.bincount(self.assignments, minlength=len(self.centroids))
+        self.list_ids = order
+        self.list_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    @classmethod
+    def train(cls, vectors, n_lists=None, iterations=20, sample_size=100000, seed=0, nprobe=None):
+        """
+        Runs spherical k-means on (a sample of) vectors and assigns every vector to its list.
+        n_lists defaults to about sqrt(len(vectors)).
+        """
+        rng = np.random.default_rng(seed)
+        n = len(vectors)
+        n_lists = n_lists or max(1, int(np.sqrt(n)))
+        n_lists = min(n_lists, n)
+
+        sample_ids = np.sort(rng.choice(n, size=min(sample_size, n), replace=False))
+        sample = _normalize(vectors[sample_ids])
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=n_lists)
+            empty = counts == 0
+            if empty.any():
+                # Re-seed empty lists with random sample points
+                sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+            centroids = _normalize(sums)
+
+        return cls(vectors, centroids, _assign(vectors, centroids), nprobe=nprobe)
+
+    def add(self, vectors):
+        """
+        Switches to vectors, the current matrix with new rows appended, and assigns the
+        new rows to their nearest lists without retraining.
+        """
+        new_rows = vectors[len(self.assignments):]
+        self.vectors = vectors
+        self.assignments = np.concatenate([self.assignments, _assign(new_rows, self.centroids)])
+        if self.live is not None:
+            self.live = np.concatenate([self.live, np.ones(len(new_rows), dtype=bool)])
+        self._build_lists()
+
+    def remove(self, ids):
+        """
+        Tombstones rows: they keep their list entry but are never returned by search.
+        """
+        if self.live is None:
+            self.live = np.ones(len(self.assignments), dtype=bool)
+        self.live[np.asarray(ids, dtype=np.int64)] = False
+
+    def search(self, queries, k, nprobe=None):
+        """
+        Returns (scores, ids), both (len(queries), k), best first. Rows with fewer than
+        k candidates in the probed lists are padded with score -inf and id -1.
+        """
+        queries = _normalize(np.atleast_2d(queries))
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probes = top_k_indices(queries @ self.centroids.T, nprobe)
+
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for q, lists in enumerate(probes):
+            candidates = np.concatenate([
+                self.list_ids[self.list_offsets[l]:self.list_offsets[l + 1]] for l in lists
+            ])
+            if self.live is not None:
+                candidates = candidates[self.live[candidates]]
+            if len(candidates) == 0:
+                continue
+            candidates.sort()
+            scores = cos_sim(queries[q], self.vectors[candidates])
+            best = top_k_indices(scores, k)[0]
+            all_scores[q, :len(best)] = scores[0, best]
+            all_ids[q, :len(best)] = candidates[best]
+        return all_scores, all_ids
+
+    def save(self, index_dir):
+        np.savez(os.path.join(index_dir, "ivf.npz"), centroids=self.centroids, assignments=self.assignments)
+        with open(os.path.join(index_dir, "vector_index.json"), "w", encoding="utf-8") as f:
+            json.dump({"kind": self.kind, "n_lists": len(self.centroids), "nprobe": self.nprobe}, f)
+
+
+def build_vector_index(vectors, kind="auto", **kwargs):
+    """
+    Builds the vector index for vectors: "flat" (exact), "ivf" (approximate) or
+    "auto", which picks IVF only once the corpus reaches AUTO_IVF_THRESHOLD vectors.
+    """
+    if kind == "auto":
+        kind = "ivf" if len(vectors) >= AUTO_IVF_THRESHOLD else "flat"
+    if kind == "flat":
+        return BruteForceIndex(vectors)
+    if kind == "ivf":
+        return IVFIndex.train(vectors, **kwargs)
+    raise ValueError(f"Unknown vector index kind '{kind}'")
+
+
+def load_vector_index(index_dir, vectors):
+    """
+    Loads the vector index saved in index_dir over vectors, defaulting to exact search.
+    """
+    meta_path = os.path.join(index_dir, "vector_index.json")
+    if not os.path.exists(meta_path):
+        return BruteForceIndex(vectors)
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["kind"] == "ivf":
+        data = np.load(os.path.join(index_dir, "ivf.npz"))
+        # Rows appended after the index was saved (an interrupted update) are not part of it
+        return IVFIndex(vectors, data["centroids"], data["assignments"][:len(vectors)], nprobe=meta.get("nprobe"))
+    return BruteForceIndex(vectors)
+
+
+def recall_at_k(approx_ids, exact_ids):
+    """
+    Fraction of the exact top-k ids that the approximate search also returned, over
+    all queries. Padding ids (-1) are ignored on both sides.
+    """
+    hits = 0
+    total = 0
+    for a, e in zip(np.atleast_2d(approx_ids).tolist(), np.atleast_2d(exact_ids).tolist()):
+        exact = {i for i in e if i >= 0}
+        hits += len(exact & {i for i in a if i >= 0})
+        total += len(exact)
+    return hits / total if total else 1.0
+
+
+def evaluate_recall(index, queries, k, nprobe_values=None):
+    """
+    Reports recall@k and per-query latency of index against exact search on queries,
+    optionally for several nprobe settings of an IVF index.
+    """
+    exact = BruteForceIndex(index.vectors)
+    exact.live = index.live
+    start = time.perf_counter()
+    _, exact_ids = exact.search(queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = {"k": k, "queries": len(queries), "vectors": len(index), "kind": index.kind,
+              "exact_ms_per_query": round(exact_ms, 3), "runs": []}
+    for nprobe in (nprobe_values or [getattr(index, "nprobe", None)]):
+        start = time.perf_counter()
+        _, ids = index.search(queries, k, nprobe=nprobe) if index.kind == "ivf" else index.search(queries, k)
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        report["runs"].append({
+            "nprobe": nprobe, "recall_at_k": round(recall_at_k(ids, exact_ids), 4),
+            "ms_per_query": round(elapsed_ms, 3)
+        })
+    return report